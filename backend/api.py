@@ -1,23 +1,124 @@
 import asyncio
-import json
-import time
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
-from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
-from aiortc.contrib.media import VideoFrame, MediaRelay
-import numpy as np
-import cv2
+from fastapi.responses import JSONResponse, Response
 from fastapi import File, UploadFile
-from io import BytesIO
-from PIL import Image
-from skin import predict_skin_tone, generate_filters
 
-from utils import read_landmarks, add_mask, face_points
-from product_utils import get_unique_shades_by_product_type, get_products_for_makeup
+import engines
+import metrics
+from render_pool import RenderPool
+from result_cache import ResultCache, SqliteStore, content_key
+from product_utils import CATALOG_SOURCE, close_mongo_client, find_products_for_makeup, get_mongo_client, get_unique_shades_by_product_type, get_products_for_makeup, get_nearest_products_for_makeup, get_catalog, resolve_fields
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+# How makeup is blended onto frames: "alpha" (label map + lookup tables, colours
+# never clip) or "additive" (the original mask added on top of the frame)
+BLEND_MODE = os.getenv("BLEND_MODE", "alpha")
+# Alpha mode: "yuv" keeps WebRTC frames in their decoded I420 planes (one RGB
+# conversion for FaceMesh, makeup blended in YUV, no BGR round trip); "bgr"
+# converts every frame to BGR and back
+FRAME_FORMAT = os.getenv("FRAME_FORMAT", "yuv")
+# Additive mode: composite only inside the face bounding box (set
+# ROI_COMPOSITING=0 for full-frame); alpha mode always uses the face box
+ROI_COMPOSITING = os.getenv("ROI_COMPOSITING", "1") != "0"
+# Render WebRTC frames in this many worker processes (0 renders in-process on threads)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0"))
+# Frames allowed in flight per render worker before new frames are dropped
+RENDER_MAX_PENDING = int(os.getenv("RENDER_MAX_PENDING", "2"))
+# Run FaceMesh at most every LANDMARK_MAX_INTERVAL frames, tracking landmarks in
+# between, when inference cannot keep up with LANDMARK_TARGET_FPS (1 disables).
+# LANDMARK_INFERENCE_SIZE resizes frames to that short side for FaceMesh (0
+# keeps the camera resolution; see bench_inference_size.py before enabling)
+LANDMARK_OPTIONS = {
+    "target_fps": float(os.getenv("LANDMARK_TARGET_FPS", "30")),
+    "max_interval": int(os.getenv("LANDMARK_MAX_INTERVAL", "4")),
+    "inference_size": int(os.getenv("LANDMARK_INFERENCE_SIZE", "0")),
+}
+
+# Micro-batching for /beautify skin tone inference
+SKIN_MAX_BATCH = int(os.getenv("SKIN_MAX_BATCH", "8"))
+SKIN_MAX_WAIT_MS = float(os.getenv("SKIN_MAX_WAIT_MS", "5"))
+
+# Skin tone results cached by a hash of the uploaded bytes (size 0 disables);
+# BEAUTIFY_CACHE_PATH adds an SQLite file shared by every worker on the host,
+# holding at most BEAUTIFY_CACHE_STORE_SIZE rows (0 for no cap)
+BEAUTIFY_CACHE_SIZE = int(os.getenv("BEAUTIFY_CACHE_SIZE", "1024"))
+BEAUTIFY_CACHE_TTL = float(os.getenv("BEAUTIFY_CACHE_TTL", "3600"))
+BEAUTIFY_CACHE_PATH = os.getenv("BEAUTIFY_CACHE_PATH", "")
+BEAUTIFY_CACHE_STORE_SIZE = int(os.getenv("BEAUTIFY_CACHE_STORE_SIZE", "100000"))
+
+# Catalog loads and lookups run on this many dedicated threads, so they never
+# queue behind WebRTC frames on asyncio's default executor
+CATALOG_WORKERS = int(os.getenv("CATALOG_WORKERS", "4"))
+
+# Where exact-shade /products matches come from: "catalog" (the in-memory
+# index) or "mongo" (indexed $in queries, for catalogs too big to hold)
+PRODUCTS_QUERY = os.getenv("PRODUCTS_QUERY", "catalog")
+
+# Engines to load at startup instead of on first use: comma-separated names
+# from engines.py, "all", or empty
+WARMUP_ENGINES = os.getenv("WARMUP_ENGINES", "catalog")
+
+render_pool = None
+skin_batcher = None
+beautify_cache = None
+catalog_executor = None
+warmup_task = None
+
+def warmup_engine_names() -> list:
+    if WARMUP_ENGINES.strip() == "all":
+        return engines.names()
+    return [name.strip() for name in WARMUP_ENGINES.split(",") if name.strip()]
+
+async def run_catalog(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    with metrics.STAGE_SECONDS.time(stage="catalog_query"):
+        return await loop.run_in_executor(catalog_executor, functools.partial(fn, *args, **kwargs))
+
+def get_skin_batcher():
+    # First call imports torch and loads the skin model
+    global skin_batcher
+    if skin_batcher is None:
+        skin = engines.get("skin")
+        skin_batcher = skin.SkinToneBatcher(max_batch=SKIN_MAX_BATCH, max_wait=SKIN_MAX_WAIT_MS / 1000)
+    return skin_batcher
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global render_pool, beautify_cache, catalog_executor, warmup_task
+    catalog_executor = ThreadPoolExecutor(CATALOG_WORKERS, thread_name_prefix="catalog")
+    if CATALOG_SOURCE == "mongo":
+        # one pool for the whole app, sized by MONGO_MAX_POOL_SIZE
+        get_mongo_client()
+    if BEAUTIFY_CACHE_SIZE > 0:
+        store = SqliteStore(BEAUTIFY_CACHE_PATH, BEAUTIFY_CACHE_TTL, BEAUTIFY_CACHE_STORE_SIZE) if BEAUTIFY_CACHE_PATH else None
+        beautify_cache = ResultCache(BEAUTIFY_CACHE_SIZE, BEAUTIFY_CACHE_TTL, store)
+    if RENDER_WORKERS > 0:
+        render_pool = RenderPool(RENDER_WORKERS, max_pending=RENDER_MAX_PENDING, roi_compositing=ROI_COMPOSITING, blend_mode=BLEND_MODE, landmark_options=LANDMARK_OPTIONS)
+    # Warm up in the background so the server accepts requests (and reports
+    # not-ready on /ready) while heavy engines load
+    warmup_task = asyncio.create_task(asyncio.to_thread(engines.warm_up, warmup_engine_names()))
+    yield
+    await warmup_task
+    if skin_batcher is not None:
+        await skin_batcher.stop()
+    if beautify_cache is not None:
+        beautify_cache.close()
+        beautify_cache = None
+    await asyncio.gather(*(pc.close() for pc in list(pcs)))
+    pcs.clear()
+    if render_pool is not None:
+        render_pool.close()
+        render_pool = None
+    catalog_executor.shutdown(wait=False, cancel_futures=True)
+    catalog_executor = None
+    close_mongo_client()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Adjust for production use
@@ -25,139 +126,151 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-relay = MediaRelay()
 pcs = set()
+metrics.Gauge("makeup_active_sessions", "Open WebRTC peer connections.", fn=lambda: len(pcs))
 
-def hex_to_bgr(hex_color: str):
-    hex_color = hex_color.lstrip("#")
-    return [int(hex_color[i:i+2], 16) for i in (4, 2, 0)]
+@app.get("/ready")
+async def ready():
+    # 200 once the warm-up engines are loaded; lists every engine's state
+    loaded = all(engines.status()[name]["loaded"] for name in warmup_engine_names())
+    body = {"ready": loaded, "engines": engines.status(), "active_sessions": len(pcs)}
+    if beautify_cache is not None:
+        body["beautify_cache"] = beautify_cache.stats()
+    return JSONResponse(body, status_code=200 if loaded else 503)
 
-def process_frame(img, makeup_params, intensity):
-    try:
-        landmarks = read_landmarks(img)
-        if not landmarks or len(landmarks) == 0:
-            return img
-    except Exception as e:
-        return img
-    face_elements = ["FOUNDATION", "LIP_LOWER", "LIP_UPPER", "EYEBROW_LEFT", "EYEBROW_RIGHT", "EYELINER_LEFT", "EYELINER_RIGHT", "EYESHADOW_LEFT", "EYESHADOW_RIGHT", "BLUSH_LEFT", "BLUSH_RIGHT"]
-    colors = [hex_to_bgr(makeup_params.get(element, "#000000")) for element in face_elements]
-    connections = [face_points["FACE"] if element == "FOUNDATION" else face_points[element] for element in face_elements]
-    mask = np.zeros_like(img)
-    mask = add_mask(mask, idx_to_coordinates=landmarks, face_connections=connections, colors=colors)
-    processed = cv2.addWeighted(img, 1.0, mask, intensity, 1)
-    return processed
-
-class LatestFrameTrack(MediaStreamTrack):
-    kind = "video"
-    def __init__(self, track, makeup_params, intensity_container):
-        super().__init__()
-        self.track = track
-        self.makeup_params = makeup_params
-        self.intensity = intensity_container
-        self.latest = None
-        asyncio.create_task(self._update())
-
-    async def _update(self):
-        while True:
-            frame = await self.track.recv()
-            # Overwrite with the most recent frame
-            self.latest = frame
-
-    async def recv(self):
-        # Wait until a frame is available
-        while self.latest is None:
-            await asyncio.sleep(0.001)
-        frame = self.latest
-        # Optionally clear latest here if you want to force waiting for a new frame:
-        self.latest = None
-        # Process frame off-thread
-        img = frame.to_ndarray(format="bgr24")
-        processed = await asyncio.to_thread(process_frame, img, self.makeup_params, self.intensity["value"])
-        new_frame = VideoFrame.from_ndarray(processed, format="bgr24")
-        new_frame.pts = frame.pts
-        new_frame.time_base = frame.time_base
-        return new_frame
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.post("/offer")
 async def offer(request: Request):
     params = await request.json()
-    offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
-    makeup = params.get("makeup", {})
-    makeup_params = makeup.get("selectedMakeup", {
-        "LIP_UPPER": "#AA0A1E",
-        "LIP_LOWER": "#AA0A1E",
-        "EYEBROW_LEFT": "#3B2F2F",
-        "EYEBROW_RIGHT": "#3B2F2F",
-        "EYELINER_LEFT": "#000000",
-        "EYELINER_RIGHT": "#000000",
-        "EYESHADOW_LEFT": "#660033",
-        "EYESHADOW_RIGHT": "#660033",
-        "BLUSH_LEFT": "#DF5B6F",
-        "BLUSH_RIGHT": "#DF5B6F",
-        "FOUNDATION": "#F1E7D5"
-    })
-    intensity = makeup.get("blendIntensity", 0.2)
-
-    # Create mutable containers for dynamic updates.
-    mutable_makeup_params = dict(makeup_params)
-    intensity_container = {"value": intensity}
-
-    pc = RTCPeerConnection()
-    pcs.add(pc)
-    pc._makeup_params = mutable_makeup_params
-    pc._intensity = intensity_container
-
-    @pc.on("datachannel")
-    def on_datachannel(channel):
-        @channel.on("message")
-        def on_message(message):
-            try:
-                data = json.loads(message)
-                if "selectedMakeup" in data:
-                    pc._makeup_params.update(data["selectedMakeup"])
-                if "blendIntensity" in data:
-                    pc._intensity["value"] = data["blendIntensity"]
-            except Exception as e:
-                print("Error updating parameters:", e)
-
-    @pc.on("track")
-    def on_track(track):
-        if track.kind == "video":
-            latest_track = LatestFrameTrack(track, pc._makeup_params, pc._intensity)
-            pc.addTrack(latest_track)
-
-    await pc.setRemoteDescription(offer)
-    answer = await pc.createAnswer()
-    await pc.setLocalDescription(answer)
-    return JSONResponse({
-        "sdp": pc.localDescription.sdp,
-        "type": pc.localDescription.type,
-    })
+    webrtc_session = await asyncio.to_thread(engines.get, "webrtc")
+    landmark_engine = None
+    if render_pool is None:
+        # the mediapipe import and FaceMesh setup take most of a second, so
+        # build the session's engine off the event loop and hand it over
+        await asyncio.to_thread(engines.get, "landmarks")
+        landmark_engine = await asyncio.to_thread(webrtc_session.create_landmark_engine, **LANDMARK_OPTIONS)
+    answer = await webrtc_session.handle_offer(params, pcs, render_pool, ROI_COMPOSITING, LANDMARK_OPTIONS, BLEND_MODE, FRAME_FORMAT, landmark_engine)
+    return JSONResponse(answer)
 
 @app.post("/beautify")
 async def beautify(file: UploadFile = File(...)):
     try:
         contents = await file.read()
-        image = Image.open(BytesIO(contents))
-        skin_tone = predict_skin_tone(image)
-        filters = generate_filters(skin_tone, num_filters=1)
-        return JSONResponse({"skin_tone": skin_tone, "filter": filters[0]})
+        skin = await asyncio.to_thread(engines.get, "skin")
+
+        async def predict():
+            batcher = await asyncio.to_thread(get_skin_batcher)
+            image = await asyncio.to_thread(skin.prepare_upload, contents)
+            return await batcher.predict(image)
+
+        # only the skin tone is cached; filters are re-randomized per request
+        if beautify_cache is None:
+            skin_tone, cached = await predict(), False
+        else:
+            skin_tone, cached = await beautify_cache.get_or_compute(content_key(contents, skin.result_namespace()), predict)
+        filters = skin.generate_filters(skin_tone, num_filters=1)
+        return JSONResponse({"skin_tone": skin_tone, "filter": filters[0]}, headers={"X-Cache": "HIT" if cached else "MISS"})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=400)
 
+# Browsers and CDNs may reuse the palette briefly, then revalidate with If-None-Match
+SHADES_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
 @app.get("/unique_shades")
-async def unique_shades():
-    shades = get_unique_shades_by_product_type()
-    return JSONResponse(shades)
+async def unique_shades(request: Request):
+    try:
+        catalog = get_catalog()
+        snapshot = catalog.snapshot() if catalog.loaded else await run_catalog(catalog.snapshot)
+    except Exception:
+        return JSONResponse(await run_catalog(get_unique_shades_by_product_type))
+    headers = {"ETag": snapshot.shades_etag, "Cache-Control": SHADES_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match", ""), snapshot.shades_etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.shades_json, media_type="application/json", headers=headers)
+
+def int_param(data: dict, name: str, default=None, minimum: int = None):
+    # an integer body field (an int or a digit string), HTTP 400 for anything
+    # else; null only stands for "not given" when there is no default
+    if name not in data:
+        return default
+    value = data[name]
+    if value is None and default is None:
+        return None
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise HTTPException(status_code=400, detail=f"{name} must be an integer")
+    if minimum is not None and value < minimum:
+        raise HTTPException(status_code=400, detail=f"{name} must be at least {minimum}")
+    return value
+
+def float_param(data: dict, name: str):
+    # an optional numeric body field, HTTP 400 when it is not a number
+    value = data.get(name)
+    if value is None:
+        return None
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        return float(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be a number")
 
 @app.post("/products")
 async def recommend_products(request: Request):
     try:
         data = await request.json()
+        if not isinstance(data, dict):
+            raise HTTPException(status_code=400, detail="Expected a JSON object")
         makeup = data.get("selectedMakeup")
-        if not makeup:
+        if not makeup or not isinstance(makeup, dict):
             raise HTTPException(status_code=400, detail="selectedMakeup is required")
-        products = get_products_for_makeup(makeup)
-        return JSONResponse({"products": products})
+        # "fields": "light" or a list of field names; "page_size"/"page" page
+        # each category separately
+        try:
+            fields = resolve_fields(data.get("fields"))
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        page_size = int_param(data, "page_size", minimum=1)
+        page = int_param(data, "page", 0, minimum=0)
+        if data.get("match") == "exact":
+            find = find_products_for_makeup if PRODUCTS_QUERY == "mongo" else get_products_for_makeup
+            # one extra product per category tells whether another page exists
+            products = await run_catalog(
+                find,
+                makeup,
+                fields=fields,
+                limit=page_size + 1 if page_size is not None else None,
+                offset=page * page_size if page_size is not None else 0,
+            )
+        else:
+            # closest catalog shades per region, each product tagged with its delta_e
+            max_delta_e = float_param(data, "max_delta_e")
+            top_k = int_param(data, "top_k", 10, minimum=1)
+            products = await run_catalog(
+                get_nearest_products_for_makeup,
+                makeup,
+                k=(page + 1) * page_size + 1 if page_size is not None else top_k,
+                max_delta_e=max_delta_e,
+                fields=fields,
+            )
+            if page_size is not None:
+                # ranked by delta_e, so a page is a slice of the top matches
+                products = {category: found[page * page_size:] for category, found in products.items()}
+        if page_size is None:
+            return JSONResponse({"products": products})
+        has_more = {category: len(found) > page_size for category, found in products.items()}
+        products = {category: found[:page_size] for category, found in products.items()}
+        return JSONResponse({"products": products, "page": page, "has_more": has_more})
+    except HTTPException as e:
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
\ No newline at end of file
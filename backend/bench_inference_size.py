@@ -0,0 +1,110 @@
+"""Quality vs latency of FaceMesh at reduced inference resolutions.
+
+Runs a streaming LandmarkEngine over a clip once at native resolution and
+once per --sizes entry (the short side FaceMesh sees; 0 is native), and
+reports per size:
+
+- latency of read_array(), resize included;
+- how many frames found a face;
+- the landmark error against the native run, in full-resolution pixels and
+  as a percentage of the distance between the outer eye corners (NME).
+
+    python bench_inference_size.py sample/output_video.mp4 --sizes 640 480 360 256 192 --json sweep.json
+"""
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from render_video import StageStats
+from utils import OUTER_EYE_CORNERS, LandmarkEngine
+
+
+def read_clip(path: str, inference_size: int):
+    # [(landmarks or None, valid or None)] per frame, and the latency stats
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise SystemExit(f"Could not open {path}")
+    stats = StageStats()
+    results = []
+    with LandmarkEngine(inference_size=inference_size) as engine:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            start = time.perf_counter()
+            results.append(engine.read_array(frame))
+            stats.record(time.perf_counter() - start)
+    capture.release()
+    return results, stats
+
+
+def landmark_error(reference: list, results: list) -> dict:
+    # per-frame mean distance to the reference landmarks, over frames where
+    # both runs found a face
+    pixel_errors = []
+    normalized_errors = []
+    for (expected, expected_valid), (actual, actual_valid) in zip(reference, results):
+        if expected is None or actual is None:
+            continue
+        both = expected_valid & actual_valid
+        if not both.any():
+            continue
+        error = np.linalg.norm((actual[both] - expected[both]).astype(np.float64), axis=1).mean()
+        eye_distance = np.linalg.norm((expected[OUTER_EYE_CORNERS[0]] - expected[OUTER_EYE_CORNERS[1]]).astype(np.float64))
+        pixel_errors.append(error)
+        if eye_distance > 0:
+            normalized_errors.append(error / eye_distance * 100)
+    if not pixel_errors:
+        return {"compared": 0}
+    return {
+        "compared": len(pixel_errors),
+        "mean_px": float(np.mean(pixel_errors)),
+        "p95_px": float(np.percentile(pixel_errors, 95)),
+        "mean_nme_pct": float(np.mean(normalized_errors)),
+        "p95_nme_pct": float(np.percentile(normalized_errors, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", nargs="?", default="sample/output_video.mp4")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[640, 480, 360, 256, 192, 128])
+    parser.add_argument("--json", help="write the sweep to this file")
+    args = parser.parse_args()
+
+    rows = []
+    reference = None
+    for size in [0] + [size for size in args.sizes if size]:
+        results, stats = read_clip(args.video, size)
+        if reference is None:
+            # the native run is the reference, so its own error is zero
+            reference = results
+        row = {
+            "inference_size": size,
+            "frames": len(results),
+            "faces": sum(landmarks is not None for landmarks, _ in results),
+            "latency": stats.summary(),
+            "error": landmark_error(reference, results),
+        }
+        rows.append(row)
+
+    print(f"{'size':>6}{'faces':>8}{'mean ms':>10}{'p95 ms':>10}{'mean px':>10}{'p95 px':>10}{'NME %':>8}{'p95 NME':>9}")
+    for row in rows:
+        latency, error = row["latency"], row["error"]
+        name = row["inference_size"] or "native"
+        if error["compared"]:
+            quality = f"{error['mean_px']:>10.2f}{error['p95_px']:>10.2f}{error['mean_nme_pct']:>8.2f}{error['p95_nme_pct']:>9.2f}"
+        else:
+            quality = f"{'-':>10}{'-':>10}{'-':>8}{'-':>9}"
+        print(f"{name:>6}{row['faces']:>8}{latency.get('mean_ms', 0):>10.2f}{latency.get('p95_ms', 0):>10.2f}{quality}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"video": args.video, "sweep": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
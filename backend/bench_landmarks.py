@@ -0,0 +1,62 @@
+"""Microbenchmark: landmark dict path vs. vectorized landmark array path.
+
+Runs FaceMesh once on a sample image, then times the per-frame work that
+follows inference: converting the 478 normalized landmarks to pixels and
+gathering the point arrays for every makeup region.
+
+    python bench_landmarks.py --image sample/face.png --iterations 2000
+"""
+import argparse
+import time
+
+import cv2
+
+from utils import detect_face_landmarks, face_point_indices, face_points, landmarks_to_array, landmarks_to_dict, region_points
+
+REGIONS = ["FACE", "LIP_LOWER", "LIP_UPPER", "EYEBROW_LEFT", "EYEBROW_RIGHT", "EYELINER_LEFT", "EYELINER_RIGHT", "EYESHADOW_LEFT", "EYESHADOW_RIGHT", "BLUSH_LEFT", "BLUSH_RIGHT"]
+
+
+def dict_path(face_landmarks, width, height):
+    landmarks = landmarks_to_dict(face_landmarks, width, height)
+    return [region_points(landmarks, face_points[region]) for region in REGIONS]
+
+
+def array_path(face_landmarks, width, height):
+    landmarks, valid = landmarks_to_array(face_landmarks, width, height)
+    return [region_points(landmarks, face_point_indices[region], valid) for region in REGIONS]
+
+
+def time_per_frame(fn, iterations, *args):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(*args)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default="sample/face.png")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    if image is None:
+        raise SystemExit(f"Could not read {args.image}")
+    face_landmarks = detect_face_landmarks(image)
+    if face_landmarks is None:
+        raise SystemExit(f"No face found in {args.image}")
+    height, width = image.shape[:2]
+
+    # both paths must produce the same polygons
+    for expected, actual in zip(dict_path(face_landmarks, width, height), array_path(face_landmarks, width, height)):
+        assert (expected == actual).all()
+
+    dict_time = time_per_frame(dict_path, args.iterations, face_landmarks, width, height)
+    array_time = time_per_frame(array_path, args.iterations, face_landmarks, width, height)
+    print(f"dict path:  {dict_time * 1e6:8.1f} us/frame")
+    print(f"array path: {array_time * 1e6:8.1f} us/frame")
+    print(f"speedup:    {dict_time / array_time:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+"""Local load test for the HTTP API and the WebRTC makeup pipeline.
+
+Starts the API with uvicorn on a free local port (the catalog comes from
+products.csv, so no MongoDB is needed) unless --url points at a running
+server, then:
+
+- drives /beautify, /products and /unique_shades from --concurrency
+  closed-loop clients for --http-duration seconds each, recording throughput
+  and latency percentiles;
+- for each --sessions count, connects that many in-process aiortc peers that
+  play a clip into /offer at its frame rate. Every sent frame carries its
+  sequence number as a block barcode in the bottom-left corner, which
+  survives the codec and the makeup, so each frame that comes back gives a
+  glass-to-glass latency (send to receive, both ends in this process), and
+  the sequence numbers that never come back are the dropped frames.
+
+Results are written to --json, together with the commit and the settings, so
+runs can be compared across commits. Client and server share the machine, so
+compare runs made on the same host. Needs httpx.
+
+    python bench_load.py --sessions 1 2 4 --duration 20 --json load.json
+    python bench_load.py --server-env RENDER_WORKERS=2 --skip-http --json pool.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+from utils import DEFAULT_MAKEUP
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_VIDEO = os.path.join(HERE, "sample", "output_video.mp4")
+SAMPLE_IMAGE = os.path.join(HERE, "sample", "face.png")
+
+# frame id barcode: BARCODE_BITS blocks of BARCODE_BLOCK pixels, black or white
+BARCODE_BITS = 16
+BARCODE_BLOCK = 16
+
+MAKEUP = {"selectedMakeup": DEFAULT_MAKEUP, "blendIntensity": 0.3}
+
+
+def summarize(samples: list) -> dict:
+    # latency samples in seconds -> milliseconds percentiles
+    if not samples:
+        return {"count": 0}
+    ordered = np.sort(np.asarray(samples)) * 1000
+    return {
+        "count": len(ordered),
+        "mean_ms": float(ordered.mean()),
+        "p50_ms": float(np.percentile(ordered, 50)),
+        "p90_ms": float(np.percentile(ordered, 90)),
+        "p99_ms": float(np.percentile(ordered, 99)),
+        "max_ms": float(ordered[-1]),
+    }
+
+
+# --- HTTP ------------------------------------------------------------------
+
+def http_scenarios() -> dict:
+    # name -> request kwargs factory; a fresh dict per request
+    with open(SAMPLE_IMAGE, "rb") as f:
+        image = f.read()
+    return {
+        # unique trailing bytes (ignored by the decoder) defeat the result cache
+        "beautify": lambda: {"method": "POST", "url": "/beautify", "files": {"file": ("face.png", image + uuid.uuid4().bytes, "image/png")}},
+        "beautify_cached": lambda: {"method": "POST", "url": "/beautify", "files": {"file": ("face.png", image, "image/png")}},
+        "products_nearest": lambda: {"method": "POST", "url": "/products", "json": {"selectedMakeup": DEFAULT_MAKEUP, "fields": "light", "page_size": 10}},
+        "products_exact": lambda: {"method": "POST", "url": "/products", "json": {"selectedMakeup": DEFAULT_MAKEUP, "match": "exact", "fields": "light", "page_size": 10}},
+        "unique_shades": lambda: {"method": "GET", "url": "/unique_shades"},
+    }
+
+
+async def run_http_scenario(client, make_request, concurrency: int, duration: float) -> dict:
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await client.request(**make_request())
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            statuses[status] = statuses.get(status, 0) + 1
+            if status.startswith("2") or status == "304":
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests": sum(statuses.values()),
+        "statuses": statuses,
+        "throughput_rps": len(latencies) / elapsed,
+        "latency": summarize(latencies),
+    }
+
+
+async def run_http(url: str, names: list, concurrency: int, duration: float) -> dict:
+    import httpx
+
+    scenarios = http_scenarios()
+    results = {}
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        for name in names:
+            # one untimed request so lazy loads are not part of the numbers
+            await client.request(**scenarios[name]())
+            results[name] = await run_http_scenario(client, scenarios[name], concurrency, duration)
+    return results
+
+
+# --- WebRTC ----------------------------------------------------------------
+
+def load_clip(path: str, width: int, max_frames: int):
+    # BGR frames resized to `width` (even sides, for I420), and the frame rate
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise SystemExit(f"Could not open {path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = []
+    while len(frames) < max_frames:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        height = int(round(frame.shape[0] * width / frame.shape[1]))
+        frames.append(cv2.resize(frame, (width - width % 2, height - height % 2), interpolation=cv2.INTER_AREA))
+    capture.release()
+    if not frames:
+        raise SystemExit(f"No frames in {path}")
+    return frames, fps
+
+
+def stamp(image: np.array, seq: int):
+    y0 = image.shape[0] - BARCODE_BLOCK
+    for bit in range(BARCODE_BITS):
+        value = 255 if seq >> bit & 1 else 0
+        image[y0:, bit * BARCODE_BLOCK:(bit + 1) * BARCODE_BLOCK] = value
+
+
+def read_stamp(luma: np.array) -> int:
+    # sample the centre of each block
+    y = luma.shape[0] - BARCODE_BLOCK // 2
+    seq = 0
+    for bit in range(BARCODE_BITS):
+        if luma[y, bit * BARCODE_BLOCK + BARCODE_BLOCK // 2] > 128:
+            seq |= 1 << bit
+    return seq
+
+
+class Session:
+    """One peer: sends the clip, receives the made-up video and times it."""
+
+    def __init__(self, url: str, frames: list, fps: float):
+        self.url = url
+        self.frames = frames
+        self.fps = fps
+        self.sent = {}
+        self.received = {}
+        self.pc = None
+        self._consumer = None
+
+    def _sender(self):
+        from aiortc import MediaStreamTrack
+        from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE
+        from av import VideoFrame
+
+        session = self
+        frame_time = 1 / self.fps
+
+        class ClipTrack(MediaStreamTrack):
+            kind = "video"
+
+            def __init__(self):
+                super().__init__()
+                self.seq = 0
+                self.start = None
+
+            async def recv(self):
+                # paced at the clip's frame rate
+                if self.start is None:
+                    self.start = time.perf_counter()
+                delay = self.start + self.seq * frame_time - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                seq = self.seq
+                self.seq += 1
+                image = session.frames[seq % len(session.frames)].copy()
+                stamp(image, seq % (1 << BARCODE_BITS))
+                frame = VideoFrame.from_ndarray(image, format="bgr24")
+                frame.pts = int(seq * frame_time * VIDEO_CLOCK_RATE)
+                frame.time_base = VIDEO_TIME_BASE
+                session.sent[seq % (1 << BARCODE_BITS)] = time.perf_counter()
+                return frame
+
+        return ClipTrack()
+
+    async def _consume(self, track):
+        from aiortc.mediastreams import MediaStreamError
+
+        try:
+            while True:
+                frame = await track.recv()
+                now = time.perf_counter()
+                seq = read_stamp(frame.to_ndarray(format="gray"))
+                if seq in self.sent and seq not in self.received:
+                    self.received[seq] = now
+        except (MediaStreamError, asyncio.CancelledError):
+            pass
+
+    async def start(self, client):
+        from aiortc import RTCPeerConnection, RTCSessionDescription
+
+        self.pc = RTCPeerConnection()
+        self.pc.addTrack(self._sender())
+
+        @self.pc.on("track")
+        def on_track(track):
+            if track.kind == "video":
+                self._consumer = asyncio.ensure_future(self._consume(track))
+
+        await self.pc.setLocalDescription(await self.pc.createOffer())
+        offer = {"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type, "makeup": MAKEUP}
+        response = await client.post(self.url + "/offer", json=offer)
+        response.raise_for_status()
+        answer = response.json()
+        await self.pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+
+    async def stop(self):
+        if self._consumer is not None:
+            self._consumer.cancel()
+        if self.pc is not None:
+            await self.pc.close()
+
+    def stats(self, since: float, until: float) -> dict:
+        # frames sent in [since, until - grace] count; later ones may still
+        # be in flight when the run stops
+        grace = 1.0
+        counted = [seq for seq, sent in self.sent.items() if since <= sent <= until - grace]
+        delivered = [seq for seq in counted if seq in self.received]
+        latencies = [self.received[seq] - self.sent[seq] for seq in delivered]
+        window = max(until - grace - since, 1e-9)
+        return {
+            "sent": len(counted),
+            "delivered": len(delivered),
+            "dropped": len(counted) - len(delivered),
+            "delivered_fps": len(delivered) / window,
+            "latencies": latencies,
+        }
+
+
+async def scrape_counters(client, url: str, names: tuple) -> dict:
+    # {sample line name with labels: value} for the given metric names
+    try:
+        response = await client.get(url + "/metrics")
+    except Exception:
+        return {}
+    values = {}
+    for line in response.text.splitlines():
+        if line.startswith(names):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+async def run_webrtc(url: str, sessions: int, frames: list, fps: float, duration: float, warmup: float) -> dict:
+    import httpx
+
+    counters = ("makeup_frames_dropped_total", "makeup_frames_rendered_total")
+    peers = [Session(url, frames, fps) for _ in range(sessions)]
+    async with httpx.AsyncClient(timeout=60) as client:
+        before = await scrape_counters(client, url, counters)
+        try:
+            await asyncio.gather(*(peer.start(client) for peer in peers))
+            started = time.perf_counter()
+            await asyncio.sleep(warmup + duration)
+            stopped = time.perf_counter()
+        finally:
+            await asyncio.gather(*(peer.stop() for peer in peers), return_exceptions=True)
+        after = await scrape_counters(client, url, counters)
+
+    per_session = [peer.stats(started + warmup, stopped) for peer in peers]
+    latencies = [latency for stats in per_session for latency in stats.pop("latencies")]
+    sent = sum(stats["sent"] for stats in per_session)
+    dropped = sum(stats["dropped"] for stats in per_session)
+    return {
+        "sessions": sessions,
+        "frame_size": list(frames[0].shape[1::-1]),
+        "source_fps": fps,
+        "seconds": duration,
+        "delivered_fps_per_session": sum(stats["delivered_fps"] for stats in per_session) / sessions,
+        "dropped_ratio": dropped / sent if sent else None,
+        "glass_to_glass": summarize(latencies),
+        "per_session": per_session,
+        # counters are server-lifetime totals, so only the difference is this run
+        "server_counters": {name: after[name] - before.get(name, 0) for name in after},
+    }
+
+
+# --- server ----------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def warmup_engines(args) -> list:
+    # the engines.py engines the selected scenarios use
+    names = []
+    if not args.skip_http:
+        if any(name.startswith("beautify") for name in args.endpoints):
+            names.append("skin")
+        if any(not name.startswith("beautify") for name in args.endpoints):
+            names.append("catalog")
+    if not args.skip_webrtc:
+        names += ["landmarks", "webrtc"]
+    return names
+
+
+def start_server(server_env: list, engine_names: list, timeout: float):
+    # uvicorn subprocess on a free port, serving the CSV catalog; returns once
+    # /ready reports the engines loaded. Runs in the current directory, like
+    # a server started by hand, so relative model paths resolve the same way
+    import httpx
+
+    port = free_port()
+    env = dict(os.environ, CATALOG_SOURCE="csv", WARMUP_ENGINES=",".join(engine_names))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [HERE, env.get("PYTHONPATH")]))
+    for item in server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with code {process.returncode}")
+        try:
+            response = httpx.get(url + "/ready", timeout=1)
+        except httpx.HTTPError:
+            response = None
+        if response is not None:
+            if response.status_code == 200:
+                return process, url
+            failed = {name: state["error"] for name, state in response.json()["engines"].items() if name in engine_names and state["error"]}
+            if failed:
+                process.terminate()
+                raise SystemExit(f"Server engines failed to load: {failed}")
+        time.sleep(0.5)
+    process.terminate()
+    raise SystemExit(f"Server not ready after {timeout} s")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: dict):
+    for name, result in results.get("http", {}).items():
+        latency = result["latency"]
+        print(f"{name:<18}{result['throughput_rps']:>8.1f} req/s  p50 {latency.get('p50_ms', 0):>7.1f} ms  "
+              f"p99 {latency.get('p99_ms', 0):>7.1f} ms  {result['statuses']}")
+    for result in results.get("webrtc", []):
+        latency = result["glass_to_glass"]
+        dropped = result["dropped_ratio"]
+        print(f"webrtc x{result['sessions']:<11}{result['delivered_fps_per_session']:>8.1f} fps/session  "
+              f"p50 {latency.get('p50_ms', 0):>7.1f} ms  p99 {latency.get('p99_ms', 0):>7.1f} ms  "
+              f"dropped {dropped * 100 if dropped is not None else 0:.1f}%")
+
+
+async def run(args, url: str) -> dict:
+    results = {}
+    if not args.skip_http:
+        results["http"] = await run_http(url, args.endpoints, args.concurrency, args.http_duration)
+    if not args.skip_webrtc:
+        frames, fps = load_clip(args.video, args.width, args.max_frames)
+        results["webrtc"] = []
+        for sessions in args.sessions:
+            results["webrtc"].append(await run_webrtc(url, sessions, frames, fps, args.duration, args.warmup))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark this running server instead of starting one")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE", help="environment for the started server (repeatable)")
+    parser.add_argument("--startup-timeout", type=float, default=180)
+    parser.add_argument("--endpoints", nargs="+", default=list(http_scenarios()), choices=list(http_scenarios()))
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent HTTP clients")
+    parser.add_argument("--http-duration", type=float, default=10, help="seconds per HTTP scenario")
+    parser.add_argument("--video", default=SAMPLE_VIDEO)
+    parser.add_argument("--width", type=int, default=640, help="width the clip is sent at")
+    parser.add_argument("--max-frames", type=int, default=150, help="frames of the clip kept in memory and looped")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4], help="concurrent WebRTC sessions per run")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per WebRTC run")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of each WebRTC run left out of the numbers")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--skip-webrtc", action="store_true")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server(args.server_env, warmup_engines(args), args.startup_timeout)
+    try:
+        results = asyncio.run(run(args, url))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    print_report(results)
+    if args.json:
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "settings": {key: value for key, value in vars(args).items() if key != "json"},
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Accuracy parity and latency/throughput of the skin tone model backends.
+
+Compares every exported artifact (see skin_export.py) against the eager fp32
+model on the images in --images: top-1 agreement, the largest logit
+difference, single-image latency and batched throughput.
+
+    python bench_skin_model.py --images sample --batch 8 --iterations 20
+"""
+import argparse
+import statistics
+import time
+
+import torch
+
+from skin import MODEL_ARTIFACTS, get_model, load_inference_model, predict_batch
+from skin_export import CALIBRATION_DIR, calibration_tensors
+
+
+def logits(classifier, image_tensor):
+    with torch.no_grad():
+        return classifier(image_tensor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=CALIBRATION_DIR)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    images = calibration_tensors(args.images)
+    reference = [logits(get_model(), image_tensor) for image_tensor in images]
+    batch = images[0].repeat(args.batch, 1, 1, 1)
+
+    print(f"{'backend':<18}{'top-1 agree':>12}{'max |dlogit|':>14}{'p50 ms (1)':>12}{f'img/s ({args.batch})':>14}")
+    for backend in ["eager"] + sorted(MODEL_ARTIFACTS):
+        try:
+            classifier = load_inference_model(backend)
+        except RuntimeError as e:
+            print(f"{backend:<18}skipped: {e}")
+            continue
+        outputs = [logits(classifier, image_tensor) for image_tensor in images]
+        agree = sum(int(out.argmax(1) == ref.argmax(1)) for out, ref in zip(outputs, reference)) / len(images)
+        max_diff = max(float((out - ref).abs().max()) for out, ref in zip(outputs, reference))
+
+        predict_batch(images[0], classifier)
+        latencies = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            predict_batch(images[0], classifier)
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(max(1, args.iterations // 4)):
+            predict_batch(batch, classifier)
+        throughput = max(1, args.iterations // 4) * args.batch / (time.perf_counter() - start)
+        print(f"{backend:<18}{agree:>12.0%}{max_diff:>14.4f}{statistics.median(latencies) * 1000:>12.1f}{throughput:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Cold-start benchmark for the API process.
+
+Imports `api` in fresh interpreters with `python -X importtime`, reports the
+median import time and the slowest modules, then times the first use of
+each lazy engine (see engines.py) in its own fresh interpreter.
+
+    python bench_startup.py --runs 5 --json startup.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+ENGINE_SNIPPET = """
+import time, engines
+start = time.perf_counter()
+engines.get({name!r})
+print(time.perf_counter() - start)
+"""
+
+
+def import_times(module: str) -> dict:
+    # cumulative microseconds for the module and each module it imports
+    # directly, from -X importtime (nesting is two spaces per level)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(result.stderr[-2000:])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def engine_time(name: str):
+    result = subprocess.run([sys.executable, "-c", ENGINE_SNIPPET.format(name=name)], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="api")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--engines", nargs="*", default=None, help="engines to time (default: all registered)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    total = statistics.median(run[args.module] for run in runs) / 1e6
+    modules = {name: statistics.median(run.get(name, 0) for run in runs) / 1e6 for name in runs[0]}
+    print(f"import {args.module}: {total:.3f} s (median of {args.runs})")
+    for name, seconds in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<30}{seconds:8.3f} s")
+
+    import engines
+    engine_names = args.engines if args.engines is not None else engines.names()
+    first_use = {name: engine_time(name) for name in engine_names}
+    print("first use:")
+    for name, seconds in first_use.items():
+        print(f"  {name:<30}{'failed' if seconds is None else f'{seconds:8.3f} s'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"module": args.module, "import_seconds": total, "modules": modules, "engine_first_use_seconds": first_use}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
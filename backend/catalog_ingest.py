@@ -0,0 +1,74 @@
+"""Load the product catalog CSV into MongoDB.
+
+Streams the CSV in --chunk-size row chunks, converts each row with
+product_utils.product_document() (product_colors parsed into structured
+arrays of normalized hex values), and writes each chunk as one unordered bulk
+of upserts keyed on the product id. Re-running it updates products in place
+instead of duplicating them, and memory stays flat whatever the catalog size.
+Also creates the indexes the catalog and /products queries rely on.
+
+    python catalog_ingest.py products.csv --chunk-size 5000
+"""
+import argparse
+import time
+
+from pymongo import ASCENDING, ReplaceOne
+
+from product_utils import CATALOG_CSV, connect_to_mongo, iter_csv_chunks, product_document
+
+# (keys, options) per index
+CATALOG_INDEXES = [
+    # upsert key
+    ([("id", ASCENDING)], {"unique": True, "name": "id_unique"}),
+    # shade lookups: products of one category containing any of the given hexes
+    ([("makeup_category", ASCENDING), ("shade_hexes", ASCENDING)], {"name": "category_shades"}),
+    ([("product_type", ASCENDING)], {"name": "product_type"}),
+]
+
+
+def ensure_indexes(collection):
+    for keys, options in CATALOG_INDEXES:
+        collection.create_index(keys, **options)
+
+
+def upsert_chunk(collection, records: list) -> dict:
+    requests = []
+    skipped = 0
+    for record in records:
+        doc = product_document(record)
+        if doc.get("id") is None:
+            skipped += 1
+            continue
+        requests.append(ReplaceOne({"id": doc["id"]}, doc, upsert=True))
+    if not requests:
+        return {"upserted": 0, "modified": 0, "matched": 0, "skipped": skipped}
+    result = collection.bulk_write(requests, ordered=False)
+    return {"upserted": result.upserted_count, "modified": result.modified_count, "matched": result.matched_count, "skipped": skipped}
+
+
+def ingest_csv(collection, csv_file: str, chunk_size: int = 5000) -> dict:
+    ensure_indexes(collection)
+    totals = {"rows": 0, "upserted": 0, "modified": 0, "matched": 0, "skipped": 0}
+    for records in iter_csv_chunks(csv_file, chunk_size):
+        totals["rows"] += len(records)
+        for key, value in upsert_chunk(collection, records).items():
+            totals[key] += value
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv_file", nargs="?", default=CATALOG_CSV)
+    parser.add_argument("--collection", default="products")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    totals = ingest_csv(connect_to_mongo(collection_name=args.collection), args.csv_file, args.chunk_size)
+    print(f"{totals['rows']} rows in {time.perf_counter() - start:.2f} s: "
+          f"{totals['upserted']} inserted, {totals['modified']} updated, "
+          f"{totals['matched'] - totals['modified']} unchanged, {totals['skipped']} skipped (no id)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import importlib
+import threading
+import time
+
+
+class LazyEngine:
+    """A heavy subsystem that is imported and initialized on first use.
+
+    get() runs the loader once, under a lock, and caches its result; the load
+    time and any load error are kept for the readiness report.
+    """
+
+    def __init__(self, name: str, loader):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._value = None
+        self.loaded = False
+        self.load_seconds = None
+        self.error = None
+
+    def get(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    start = time.perf_counter()
+                    try:
+                        self._value = self._loader()
+                    except Exception as e:
+                        self.error = str(e)
+                        raise
+                    self.load_seconds = time.perf_counter() - start
+                    self.error = None
+                    self.loaded = True
+        return self._value
+
+    def status(self) -> dict:
+        return {"loaded": self.loaded, "load_seconds": self.load_seconds, "error": self.error}
+
+
+_engines = {}
+
+
+def register(name: str, loader) -> LazyEngine:
+    engine = _engines[name] = LazyEngine(name, loader)
+    return engine
+
+
+def get(name: str):
+    return _engines[name].get()
+
+
+def names() -> list:
+    return list(_engines)
+
+
+def status() -> dict:
+    return {name: engine.status() for name, engine in _engines.items()}
+
+
+def warm_up(engine_names: list):
+    # load the named engines now; failures are recorded in status(), not raised
+    for name in engine_names:
+        try:
+            get(name)
+        except Exception as e:
+            print(f"Error warming up {name} engine: {e}")
+
+
+def _load_skin():
+    skin = importlib.import_module("skin")
+    skin.get_inference_model()
+    return skin
+
+
+def _load_landmarks():
+    utils = importlib.import_module("utils")
+    utils.load_mediapipe()
+    return utils
+
+
+def _load_catalog():
+    product_utils = importlib.import_module("product_utils")
+    catalog = product_utils.get_catalog()
+    catalog.snapshot()
+    return catalog
+
+
+# torch/torchvision and the MobileNet weights
+register("skin", _load_skin)
+# mediapipe FaceMesh
+register("landmarks", _load_landmarks)
+# aiortc/av and the WebRTC session code
+register("webrtc", lambda: importlib.import_module("webrtc_session"))
+# product catalog snapshot (Mongo or CSV)
+register("catalog", _load_catalog)
@@ -0,0 +1,49 @@
+import asyncio
+
+
+class MailboxClosed(Exception):
+    pass
+
+
+class LatestValueMailbox:
+    """Single-slot mailbox that only keeps the newest value.
+
+    put() overwrites whatever has not been taken yet (counted in `dropped`;
+    put() then returns True) and wakes the consumer; get() sleeps on an
+    asyncio.Event until a value arrives, so an idle consumer costs nothing on
+    the event loop. Both sides must run on the same event loop.
+    """
+
+    def __init__(self):
+        self._value = None
+        self._has_value = False
+        self._event = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, value) -> bool:
+        if self.closed:
+            return False
+        dropped = self._has_value
+        if dropped:
+            self.dropped += 1
+        self._value = value
+        self._has_value = True
+        self._event.set()
+        return dropped
+
+    async def get(self):
+        while not self._has_value:
+            if self.closed:
+                raise MailboxClosed()
+            self._event.clear()
+            await self._event.wait()
+        value = self._value
+        self._value = None
+        self._has_value = False
+        return value
+
+    def close(self):
+        # wakes a pending get(), which raises MailboxClosed once the slot is empty
+        self.closed = True
+        self._event.set()
@@ -0,0 +1,146 @@
+import math
+import time
+
+import cv2
+import numpy as np
+
+from utils import LandmarkEngine, face_bbox
+
+# rigid, well-textured points (nose, eye and mouth corners, chin, forehead,
+# cheeks) used to follow the face between FaceMesh runs
+ANCHOR_POINTS = np.array([1, 4, 10, 33, 133, 152, 234, 263, 362, 454, 61, 291], dtype=np.intp)
+
+LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+
+
+class LandmarkScheduler:
+    """Runs FaceMesh on every k-th frame and tracks landmarks in between.
+
+    On skipped frames a handful of anchor landmarks are followed with sparse
+    Lucas-Kanade optical flow, and the similarity transform they describe is
+    applied to the whole mesh. FaceMesh runs again when k frames have passed,
+    when the anchors move more than motion_threshold pixels, or when tracking
+    fails. k is chosen from the measured inference and tracking latencies,
+    plus the rest of the frame's cost reported through record_frame(), so
+    that the average per-frame latency fits the target_fps budget, capped at
+    max_interval. Tracked frames keep FaceMesh's validity mask, minus points
+    that leave the frame or anchors optical flow lost.
+
+    Exposes the same read_array()/close() as LandmarkEngine.
+    """
+
+    def __init__(self, engine: LandmarkEngine, target_fps: float = 30, max_interval: int = 4, motion_threshold: float = 12.0):
+        self.engine = engine
+        self.frame_budget = 1.0 / target_fps
+        self.max_interval = max_interval
+        self.motion_threshold = motion_threshold
+        self.interval = 1
+        self.inference_latency = None
+        self.tracking_latency = None
+        # per-frame cost outside read_array() (conversions, compositing)
+        self.overhead_latency = None
+        self._read_seconds = 0.0
+        self._points = None
+        self._valid = None
+        self._previous_gray = None
+        self._roi = None
+        self._since_inference = 0
+
+    def read_array(self, image: np.array):
+        if self._points is not None and self._since_inference < self.interval - 1:
+            start = time.perf_counter()
+            gray = self._gray_roi(image)
+            tracked = self._track(gray)
+            if tracked:
+                self._read_seconds = time.perf_counter() - start
+                self.tracking_latency = _ema(self.tracking_latency, self._read_seconds)
+                self._since_inference += 1
+                self._previous_gray = gray
+                return self._to_pixels(image.shape)
+
+        start = time.perf_counter()
+        landmarks, valid = self.engine.read_array(image)
+        self._read_seconds = time.perf_counter() - start
+        self.inference_latency = _ema(self.inference_latency, self._read_seconds)
+        self._update_interval()
+        self._since_inference = 0
+        self._points = None
+        if landmarks is not None and self.interval > 1:
+            self._points = landmarks.astype(np.float32)
+            self._valid = valid.copy()
+            # track inside the face box, padded for the motion allowed until
+            # the next FaceMesh run
+            self._roi = face_bbox(landmarks, valid, image.shape, int(self.motion_threshold * self.interval) + LK_PARAMS["winSize"][0])
+            self._previous_gray = self._gray_roi(image) if self._roi else None
+            if self._roi is None:
+                self._points = None
+        return landmarks, valid
+
+    def _gray_roi(self, image: np.array) -> np.array:
+        x0, y0, x1, y1 = self._roi
+        return cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+
+    def _track(self, gray: np.array) -> bool:
+        # move the mesh by the similarity transform the anchors went through
+        offset = np.array(self._roi[:2], dtype=np.float32)
+        anchors = (self._points[ANCHOR_POINTS] - offset).reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._previous_gray, gray, anchors, None, **LK_PARAMS)
+        found = status.ravel() == 1
+        if found.sum() < 3:
+            return False
+        # anchors the flow lost are no longer trustworthy until FaceMesh runs
+        self._valid[ANCHOR_POINTS[~found]] = False
+        displacement = np.linalg.norm(moved[found] - anchors[found], axis=2)
+        if np.median(displacement) > self.motion_threshold:
+            return False
+        transform, _ = cv2.estimateAffinePartial2D(anchors[found], moved[found])
+        if transform is None:
+            return False
+        # the transform is in ROI coordinates
+        points = (self._points - offset).reshape(-1, 1, 2)
+        self._points = cv2.transform(points, transform).reshape(-1, 2) + offset
+        return True
+
+    def _to_pixels(self, shape: tuple):
+        height, width = shape[:2]
+        valid = self._valid & ((self._points >= 0) & (self._points < (width, height))).all(axis=1)
+        landmarks = np.floor(self._points)
+        np.clip(landmarks, 0, (width - 1, height - 1), out=landmarks)
+        return landmarks.astype(np.int32), valid
+
+    def record_frame(self, seconds: float):
+        # the full latency of the frame last read, as measured by the caller
+        self.overhead_latency = _ema(self.overhead_latency, max(0.0, seconds - self._read_seconds))
+
+    def _update_interval(self):
+        # smallest k with overhead + (inference + (k - 1) * tracking) / k <= frame budget
+        tracking = self.tracking_latency or 0.0
+        budget = self.frame_budget - (self.overhead_latency or 0.0)
+        if self.inference_latency <= budget:
+            self.interval = 1
+        elif tracking >= budget:
+            self.interval = self.max_interval
+        else:
+            needed = math.ceil((self.inference_latency - tracking) / (budget - tracking))
+            self.interval = min(max(needed, 1), self.max_interval)
+
+    def close(self):
+        self.engine.close()
+
+
+def create_landmark_engine(target_fps: float = 30, max_interval: int = 4, inference_size: int = 0):
+    # a streaming LandmarkEngine, wrapped in a scheduler unless skipping is off
+    engine = LandmarkEngine(inference_size=inference_size)
+    if max_interval <= 1:
+        return engine
+    return LandmarkScheduler(engine, target_fps=target_fps, max_interval=max_interval)
+
+
+def _ema(current, sample, alpha=0.2):
+    if current is None:
+        return sample
+    return (1 - alpha) * current + alpha * sample
@@ -0,0 +1,205 @@
+"""In-process metrics in the Prometheus text format.
+
+Counters, gauges and histograms keyed by label values, each guarded by its
+own lock: an observation is a dict lookup, a bisect and a few additions, so
+the hot frame path can afford several per frame. render() produces the
+/metrics body. Worker processes (render_pool.py) record into their own copy
+and ship take_deltas() to the server, which applies them with merge_deltas().
+"""
+import bisect
+import threading
+import time
+
+# seconds; frame stages take ~0.1-50 ms, model and catalog loads up to seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry = {}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        # label values are expected to be strings already
+        return tuple(map(labels.__getitem__, self.labelnames))
+
+    def _labels(self, key: tuple, extra=()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> list:
+        # [(sample name, label text, value)]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, self._labels(key), value) for key, value in items]
+
+    def take_deltas(self) -> dict:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, deltas: dict):
+        with self._lock:
+            for key, value in deltas.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that is set, or read from fn() at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), fn=None):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> list:
+        if self.fn is not None:
+            return [(self.name, "", self.fn())]
+        return super().samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (not cumulative) counts, then sum and count
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels):
+        # context manager observing the time spent inside it
+        return _Timer(self, labels)
+
+    def merge(self, deltas: dict):
+        with self._lock:
+            for key, delta in deltas.items():
+                state = self._values.get(key)
+                if state is None:
+                    self._values[key] = list(delta)
+                else:
+                    for i, value in enumerate(delta):
+                        state[i] += value
+
+    def samples(self) -> list:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        samples = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                samples.append((self.name + "_bucket", self._labels(key, [("le", _format_value(bound))]), cumulative))
+            samples.append((self.name + "_sum", self._labels(key), state[-2]))
+            samples.append((self.name + "_count", self._labels(key), state[-1]))
+        return samples
+
+
+class _Timer:
+    # a class rather than @contextmanager: half the overhead per use
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def take_deltas() -> dict:
+    # everything recorded since the last call, as {metric name: deltas}
+    deltas = {}
+    for name, metric in _registry.items():
+        if isinstance(metric, Gauge):
+            continue
+        values = metric.take_deltas()
+        if values:
+            deltas[name] = values
+    return deltas
+
+
+def merge_deltas(deltas: dict):
+    for name, values in deltas.items():
+        metric = _registry.get(name)
+        if metric is not None:
+            metric.merge(values)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Shared by the modules that record them
+STAGE_SECONDS = Histogram(
+    "makeup_stage_seconds",
+    "Time spent in each processing stage.",
+    ["stage"],
+)
+FRAMES_RENDERED = Counter("makeup_frames_rendered_total", "WebRTC frames sent back to clients.")
+FRAMES_DROPPED = Counter(
+    "makeup_frames_dropped_total",
+    "WebRTC frames skipped: superseded by a newer frame, or refused by a saturated render pool.",
+    ["reason"],
+)
+LANDMARK_FAILURES = Counter(
+    "makeup_landmark_failures_total",
+    "Frames rendered without makeup: no face found, or landmark inference raised.",
+    ["reason"],
+)
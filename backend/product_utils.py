@@ -1,28 +1,93 @@
-import pandas as pd
+import numpy as np
 from pymongo import MongoClient
 import ast
+import re
 import colorsys
+import hashlib
+import json
 from utils import parse_all_hex_colors
+from metrics import STAGE_SECONDS
 import math
 from bson import ObjectId
+from collections import namedtuple
 
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB")
+# Where the in-memory catalog loads from: "mongo" or "csv"
+CATALOG_SOURCE = os.getenv("CATALOG_SOURCE", "mongo")
+CATALOG_CSV = os.getenv("CATALOG_CSV", os.path.join(os.path.dirname(os.path.abspath(__file__)), "products.csv"))
+# Seconds before the catalog is reloaded (change streams reload it sooner)
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+
+# Selected makeup region prefix -> catalog category
+MAKEUP_CATEGORIES = [
+    ("LIP", "Lipstick"),
+    ("EYEBROW", "Eyebrow"),
+    ("EYELINER", "Eyeliner"),
+    ("EYESHADOW", "Eyeshadow"),
+    ("BLUSH", "Blush"),
+    ("FOUNDATION", "Foundation"),
+]
+
+# Connection pool shared by everything in the process (catalog loads, the
+# change stream, ingest); MongoClient is thread-safe
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "10"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+
+_mongo_client = None
+_mongo_lock = threading.Lock()
+
+def get_mongo_client(uri=MONGO_URI):
+    global _mongo_client
+    with _mongo_lock:
+        if _mongo_client is None:
+            # connects in the background; the first operation waits for it
+            _mongo_client = MongoClient(
+                uri,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            )
+    return _mongo_client
+
+def close_mongo_client():
+    global _mongo_client
+    with _mongo_lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
 
 def connect_to_mongo(uri=MONGO_URI, db_name=MONGO_DB, collection_name="products"):
-    client = MongoClient(uri)
-    db = client[db_name]
+    db = get_mongo_client(uri)[db_name]
     return db[collection_name]
 
 def read_csv_to_records(csv_file):
+    import pandas as pd
     df = pd.read_csv(csv_file)
     return df.to_dict("records")
 
+def iter_csv_chunks(csv_file, chunk_size=5000, usecols=None):
+    # lists of at most chunk_size records, NaN cells as None, so a catalog of
+    # any size is read in constant memory
+    import pandas as pd
+    for df in pd.read_csv(csv_file, chunksize=chunk_size, usecols=usecols):
+        df = df.astype(object).where(df.notna(), None)
+        yield df.to_dict("records")
+
 def insert_records_into_collection(collection, records):
     if records:
         result = collection.insert_many(records)
@@ -74,55 +139,7 @@ def sort_hex_colors_by_lightness(hex_list):
 
 def get_unique_shades_by_product_type():
     try:
-        collection = connect_to_mongo(collection_name="products")
-        result = {
-            "Lipstick": set(),
-            "Eyebrow": set(),
-            "Eyeliner": set(),
-            "Eyeshadow": set(),
-            "Blush": set(),
-            "Foundation": set(),
-        }
-        for doc in collection.find():
-            try:
-                product_type = doc.get("product_type", "")
-                product_type_lower = product_type.lower()
-                category = None
-                if "lipstick" in product_type_lower:
-                    category = "Lipstick"
-                elif "eyebrow" in product_type_lower:
-                    category = "Eyebrow"
-                elif "eyeliner" in product_type_lower:
-                    category = "Eyeliner"
-                elif "eyeshadow" in product_type_lower:
-                    category = "Eyeshadow"
-                elif "blush" in product_type_lower:
-                    category = "Blush"
-                elif "foundation" in product_type_lower:
-                    category = "Foundation"
-                if category:
-                    product_colors_str = doc.get("product_colors")
-                    if product_colors_str:
-                        try:
-                            product_colors = ast.literal_eval(product_colors_str)
-                        except Exception as parse_e:
-                            print(f"Error parsing product_colors for document {doc.get('_id')}: {parse_e}")
-                            continue
-                        for color in product_colors:
-                            hex_value = color.get("hex_value")
-                            if hex_value:
-                                try:
-                                    all_colors = parse_all_hex_colors(hex_value)
-                                    for c in all_colors:
-                                        result[category].add(c)
-                                except Exception as e:
-                                    print(f"Skipping invalid color {hex_value}: {e}")
-                                    continue
-            except Exception as doc_e:
-                print(f"Error processing document {doc.get('_id')}: {doc_e}")
-                continue
-        # Convert each set to a sorted list based on lightness.
-        return {key: sort_hex_colors_by_lightness(list(value)) for key, value in result.items()}
+        return get_catalog().snapshot().shades
     except Exception as e:
         error_msg = f"Error in get_unique_shades_by_product_type: {e}"
         print(error_msg)
@@ -142,61 +159,372 @@ def serialize_product(product):
         product[key] = sanitize_value(value)
     return product
 
-def get_products_for_makeup(selected_makeup):
-    collection = connect_to_mongo(collection_name="products")
-    # Initialize result dictionary with categories.
-    result = {
-        "Lipstick": [],
-        "Eyebrow": [],
-        "Eyeliner": [],
-        "Eyeshadow": [],
-        "Blush": [],
-        "Foundation": []
-    }
-    for doc in collection.find():
-        product_colors_str = doc.get("product_colors")
-        if not product_colors_str:
+def get_products_for_makeup(selected_makeup, fields=None, limit=None, offset=0):
+    return get_catalog().products_for_makeup(selected_makeup, fields=fields, limit=limit, offset=offset)
+
+def get_nearest_products_for_makeup(selected_makeup, k=10, max_delta_e=None, fields=None):
+    return get_catalog().nearest_products_for_makeup(selected_makeup, k=k, max_delta_e=max_delta_e, fields=fields)
+
+def resolve_fields(fields):
+    # None (every field), "light", or a list of names from PRODUCT_FIELDS
+    if fields is None:
+        return None
+    if fields == "light":
+        return LIGHT_PRODUCT_FIELDS
+    if isinstance(fields, str):
+        fields = [fields]
+    unknown = set(fields) - set(PRODUCT_FIELDS) - {"_id"}
+    if unknown:
+        raise ValueError(f"Unknown product fields: {sorted(unknown)}")
+    return list(fields)
+
+def project_product(product, fields):
+    if fields is None:
+        return product
+    return {field: product[field] for field in fields if field in product}
+
+def selected_shades(selected_makeup) -> dict:
+    # catalog category -> set of normalized hexes selected for it
+    shades = {category: set() for _, category in MAKEUP_CATEGORIES}
+    for region, sel_hex in selected_makeup.items():
+        category = category_for_makeup_region(region)
+        if category and sel_hex:
+            shades[category].update(parse_all_hex_colors(sel_hex))
+    return shades
+
+def find_products_for_makeup(selected_makeup, fields=None, limit=None, offset=0, collection=None):
+    # exact-shade matches queried in Mongo rather than the in-memory catalog:
+    # one {makeup_category, shade_hexes: {$in}} query per category, served by
+    # the category_shades index, returning only the requested fields. Needs
+    # documents written by catalog_ingest.py (shade_hexes, makeup_category).
+    collection = collection if collection is not None else connect_to_mongo(collection_name="products")
+    projection = fields or PRODUCT_FIELDS
+    result = {}
+    for category, hexes in selected_shades(selected_makeup).items():
+        if not hexes:
+            result[category] = []
             continue
+        cursor = collection.find({"makeup_category": category, "shade_hexes": {"$in": sorted(hexes)}}, projection).sort("_id", 1).skip(offset)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        result[category] = [serialize_product(doc) for doc in cursor]
+    return result
+
+def category_for_product_type(product_type: str):
+    product_type_lower = (product_type or "").lower()
+    for keyword, category in (
+        ("lipstick", "Lipstick"),
+        ("eyebrow", "Eyebrow"),
+        ("eyeliner", "Eyeliner"),
+        ("eyeshadow", "Eyeshadow"),
+        ("blush", "Blush"),
+        ("foundation", "Foundation"),
+    ):
+        if keyword in product_type_lower:
+            return category
+    return None
+
+def category_for_makeup_region(region: str):
+    for prefix, category in MAKEUP_CATEGORIES:
+        if region.startswith(prefix):
+            return category
+    return None
+
+# one {'hex_value': ..., 'colour_name': ...} entry as Python's repr() writes it
+PRODUCT_COLOR_PATTERN = re.compile(
+    r"""\{'hex_value': (?:'([^'\\]*)'|"([^"\\]*)"|None), 'colour_name': (?:'([^'\\]*)'|"([^"\\]*)"|None)\}"""
+)
+
+def parse_color_literal(product_colors_str: str) -> list:
+    # [(hex_value, colour_name)] from a product_colors literal; a regex handles
+    # the layout the catalog uses without building an AST, literal_eval
+    # anything else (escaped quotes, other keys)
+    matches = PRODUCT_COLOR_PATTERN.findall(product_colors_str)
+    if product_colors_str.startswith("[") and len(matches) == product_colors_str.count("{"):
+        return [(hex_single or hex_double or None, name_single or name_double or None) for hex_single, hex_double, name_single, name_double in matches]
+    return [(color.get("hex_value"), color.get("colour_name")) for color in ast.literal_eval(product_colors_str)]
+
+def parse_product_colors(product_colors_str) -> list:
+    # every normalized "#RRGGBB" in a product's product_colors, either the
+    # CSV's Python-literal string or the structured list product_document() stores
+    if isinstance(product_colors_str, list):
+        return [color["hex_value"] for color in product_colors_str if color.get("hex_value")]
+    if not isinstance(product_colors_str, str) or not product_colors_str:
+        return []
+    colors = []
+    for hex_value, _ in parse_color_literal(product_colors_str):
+        if hex_value:
+            colors.extend(parse_all_hex_colors(hex_value))
+    return colors
+
+def product_document(record: dict) -> dict:
+    # a CSV record as stored in Mongo: product_colors parsed into
+    # [{"hex_value": "#RRGGBB", "colour_name": ...}] (one entry per hex), plus
+    # the distinct hexes and makeup category the catalog queries index
+    doc = {key: sanitize_value(value) for key, value in record.items()}
+    product_colors = []
+    raw_colors = doc.get("product_colors")
+    if isinstance(raw_colors, str) and raw_colors:
         try:
-            product_colors = ast.literal_eval(product_colors_str)
+            for raw_hex, colour_name in parse_color_literal(raw_colors):
+                for hex_value in parse_all_hex_colors(raw_hex or ""):
+                    product_colors.append({"hex_value": hex_value, "colour_name": colour_name})
         except Exception as e:
-            print(f"Error parsing product_colors for {doc.get('_id')}: {e}")
-            continue
-        product_type = doc.get("product_type", "").lower()
-        matched_category = None
-        # Check each category based on selected makeup.
-        for category, sel_hex in selected_makeup.items():
-            sel_hex = sel_hex.lower()
-            if category.startswith("LIP") and "lipstick" in product_type:
-                if any(sel_hex == color.get("hex_value", "").lower() for color in product_colors):
-                    matched_category = "Lipstick"
-                    break
-            elif category.startswith("EYEBROW") and "eyebrow" in product_type:
-                if any(sel_hex == color.get("hex_value", "").lower() for color in product_colors):
-                    matched_category = "Eyebrow"
-                    break
-            elif category.startswith("EYELINER") and "eyeliner" in product_type:
-                if any(sel_hex == color.get("hex_value", "").lower() for color in product_colors):
-                    matched_category = "Eyeliner"
-                    break
-            elif category.startswith("EYESHADOW") and "eyeshadow" in product_type:
-                if any(sel_hex == color.get("hex_value", "").lower() for color in product_colors):
-                    matched_category = "Eyeshadow"
-                    break
-            elif category.startswith("BLUSH") and "blush" in product_type:
-                if any(sel_hex == color.get("hex_value", "").lower() for color in product_colors):
-                    matched_category = "Blush"
-                    break
-            elif category == "FOUNDATION" and "foundation" in product_type:
-                if any(sel_hex == color.get("hex_value", "").lower() for color in product_colors):
-                    matched_category = "Foundation"
-                    break
-        if matched_category:
-            result[matched_category].append(serialize_product(doc))
+            print(f"Error parsing product_colors for {doc.get('id')}: {e}")
+    doc["product_colors"] = product_colors
+    doc["shade_hexes"] = list(dict.fromkeys(color["hex_value"] for color in product_colors))
+    doc["makeup_category"] = category_for_product_type(doc.get("product_type"))
+    return doc
+
+# Product fields the catalog keeps: what the frontend shows plus what the
+# shade index is built from. Descriptions, tags, timestamps and API links are
+# never read from Mongo.
+PRODUCT_FIELDS = [
+    "id", "brand", "name", "price", "price_sign", "currency", "rating",
+    "image_link", "api_featured_image", "product_link", "website_link",
+    "category", "product_type", "product_colors", "shade_hexes", "makeup_category",
+]
+# Fields returned for {"fields": "light"}: what a product card shows
+LIGHT_PRODUCT_FIELDS = ["_id", "id", "brand", "name", "price", "price_sign", "image_link", "api_featured_image", "product_link"]
+# columns of the CSV that product_document() turns into PRODUCT_FIELDS
+CSV_PRODUCT_COLUMNS = [field for field in PRODUCT_FIELDS if field not in ("shade_hexes", "makeup_category")]
+
+def assign_csv_ids(docs) -> list:
+    # CSV rows have no Mongo ObjectId, but the frontend keys product cards by
+    # _id: use the product id, or "row-N" when it is missing or repeated
+    seen = set()
+    result = []
+    for row, doc in enumerate(docs):
+        product_id = doc.get("id")
+        _id = str(product_id) if product_id is not None else None
+        if _id is None or _id in seen:
+            _id = f"row-{row}"
+        seen.add(_id)
+        doc["_id"] = _id
+        result.append(doc)
     return result
 
-# # Code to transfer data from CSV to the 'products' collection in MongoDB
-# csv_file = "products.csv"  # Update with the correct path to your CSV file
-# collection = connect_to_mongo(collection_name="products")
-# records = read_csv_to_records(csv_file)
-# inserted_ids = insert_records_into_collection(collection, records)
+def load_catalog_documents(source=None):
+    source = source or CATALOG_SOURCE
+    if source == "csv":
+        records = (record for chunk in iter_csv_chunks(CATALOG_CSV, usecols=CSV_PRODUCT_COLUMNS) for record in chunk)
+        return assign_csv_ids(product_document(record) for record in records)
+    return list(connect_to_mongo(collection_name="products").find({}, PRODUCT_FIELDS))
+
+def hex_to_lab(hex_colors) -> np.array:
+    # "#RRGGBB" strings -> (N, 3) CIELAB (D65), vectorized
+    rgb = np.array([[int(h[i:i+2], 16) for i in (1, 3, 5)] for h in hex_colors], dtype=np.float64).reshape(-1, 3) / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array([
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ]).T
+    xyz /= (0.95047, 1.0, 1.08883)
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+# KD-tree over one category's catalog colours in CIELAB; row i of the tree is
+# colour hexes[i] of product positions[i]
+ShadeTree = namedtuple("ShadeTree", ["tree", "positions", "hexes"])
+
+def build_shade_tree(entries):
+    # entries: [(product position, "#RRGGBB"), ...]
+    from scipy.spatial import cKDTree
+    positions = np.array([position for position, _ in entries], dtype=np.intp)
+    hexes = [color for _, color in entries]
+    return ShadeTree(cKDTree(hex_to_lab(hexes)), positions, hexes)
+
+# One immutable build of the catalog: serialized products, the shade index and
+# per-category shade trees, and the /unique_shades palette pre-serialized with
+# its ETag
+CatalogSnapshot = namedtuple("CatalogSnapshot", ["products", "index", "trees", "shades", "shades_json", "shades_etag"])
+
+class ProductCatalog:
+    """In-memory product catalog with a (category, hex) -> products index.
+
+    Documents are loaded and their colours parsed once; lookups are then a
+    dictionary probe per selected shade. Each load builds a new snapshot that
+    replaces the old one in a single assignment, so readers never see a
+    half-built index. The catalog reloads in the background once `ttl`
+    seconds have passed or after a Mongo change-stream event.
+    """
+
+    def __init__(self, source=None, ttl=CATALOG_TTL):
+        self.source = source or CATALOG_SOURCE
+        self.ttl = ttl
+        self.version = 0
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._stale = False
+        self._lock = threading.Lock()
+        # held across the first load, so concurrent cold requests wait for one
+        # load instead of each running their own
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._watcher = None
+
+    def _build(self):
+        products = []
+        index = {}
+        shades = {category: set() for _, category in MAKEUP_CATEGORIES}
+        tree_entries = {category: [] for _, category in MAKEUP_CATEGORIES}
+        for doc in load_catalog_documents(self.source):
+            category = category_for_product_type(doc.get("product_type"))
+            try:
+                colors = parse_product_colors(doc.get("product_colors"))
+            except Exception as e:
+                print(f"Error parsing product_colors for {doc.get('_id', doc.get('id'))}: {e}")
+                continue
+            position = len(products)
+            products.append(serialize_product(dict(doc)))
+            if category:
+                shades[category].update(colors)
+                for color in colors:
+                    index.setdefault((category, color), []).append(position)
+                    tree_entries[category].append((position, color))
+        # sorted first so lightness ties, and therefore the ETag, do not depend
+        # on set iteration order (which changes between worker processes)
+        shades = {key: sort_hex_colors_by_lightness(sorted(value)) for key, value in shades.items()}
+        shades_json = json.dumps(shades, separators=(",", ":")).encode("utf-8")
+        shades_etag = '"%s"' % hashlib.sha256(shades_json).hexdigest()[:32]
+        trees = {category: build_shade_tree(entries) for category, entries in tree_entries.items() if entries}
+        return CatalogSnapshot(products, index, trees, shades, shades_json, shades_etag)
+
+    def refresh(self):
+        with STAGE_SECONDS.time(stage="catalog_load"):
+            snapshot = self._build()
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+            self._stale = False
+            self.version += 1
+        return self.version
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Error refreshing product catalog: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    @property
+    def loaded(self) -> bool:
+        # snapshot() returns without touching the database once this is True
+        return self._snapshot is not None
+
+    def snapshot(self):
+        if self._snapshot is None:
+            with self._load_lock:
+                if self._snapshot is None:
+                    self.refresh()
+                    self._start_watcher()
+        elif self._stale or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                start = not self._refreshing
+                self._refreshing = True
+            if start:
+                # keep serving the current snapshot while the new one builds
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return self._snapshot
+
+    def _start_watcher(self):
+        # at most one change stream per catalog
+        if self.source != "mongo":
+            return
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch_changes, daemon=True)
+        self._watcher.start()
+
+    def _watch_changes(self):
+        # change streams need a replica set (Atlas has one); standalone servers
+        # reject watch() and the catalog falls back to the TTL alone
+        try:
+            with connect_to_mongo(collection_name="products").watch() as stream:
+                for _ in stream:
+                    self._stale = True
+        except Exception as e:
+            print(f"Product catalog change stream unavailable, using TTL refresh: {e}")
+
+    def products_for_makeup(self, selected_makeup, fields=None, limit=None, offset=0):
+        # limit/offset page each category separately
+        products, index = self.snapshot()[:2]
+        result = {}
+        for category, hexes in selected_shades(selected_makeup).items():
+            found = set()
+            for color in hexes:
+                found.update(index.get((category, color), ()))
+            # catalog order, like the full scan this replaces
+            page = sorted(found)[offset:None if limit is None else offset + limit]
+            result[category] = [project_product(products[p], fields) for p in page]
+        return result
+
+    def nearest_products_for_makeup(self, selected_makeup, k=10, max_delta_e=None, fields=None):
+        # top-k products per selected region by CIE76 delta E; a product that
+        # matches several regions of one category is listed once, at its best
+        snapshot = self.snapshot()
+        best = {category: {} for _, category in MAKEUP_CATEGORIES}
+        for region, sel_hex in selected_makeup.items():
+            category = category_for_makeup_region(region)
+            colors = parse_all_hex_colors(sel_hex or "")
+            shade_tree = snapshot.trees.get(category)
+            if not colors or shade_tree is None:
+                continue
+            for position, delta_e, color in nearest_shades(shade_tree, hex_to_lab(colors[:1])[0], k, max_delta_e):
+                current = best[category].get(position)
+                if current is None or delta_e < current[0]:
+                    best[category][position] = (delta_e, color, region)
+        result = {}
+        for category, matches in best.items():
+            ranked = sorted(matches.items(), key=lambda item: item[1][0])
+            result[category] = [
+                dict(project_product(snapshot.products[position], fields), delta_e=round(delta_e, 2), matched_hex=color, region=region)
+                for position, (delta_e, color, region) in ranked
+            ]
+        return result
+
+def nearest_shades(shade_tree, lab, k, max_delta_e=None):
+    # [(product position, delta E, catalog hex)] for the k closest distinct
+    # products; widens the query until k products are found since one product
+    # can own several nearby colours
+    size = len(shade_tree.hexes)
+    if k < 1 or size == 0:
+        return []
+    upper = np.inf if max_delta_e is None else max_delta_e
+    neighbours = min(size, k * 4)
+    while True:
+        distances, rows = shade_tree.tree.query(lab, k=neighbours, distance_upper_bound=upper)
+        distances, rows = np.atleast_1d(distances), np.atleast_1d(rows)
+        found = []
+        seen = set()
+        for distance, row in zip(distances, rows):
+            if row >= size:
+                # past distance_upper_bound
+                break
+            position = int(shade_tree.positions[row])
+            if position not in seen:
+                seen.add(position)
+                found.append((position, float(distance), shade_tree.hexes[row]))
+                if len(found) == k:
+                    return found
+        if neighbours >= size or (len(rows) and rows[-1] >= size):
+            return found
+        neighbours = min(size, neighbours * 4)
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ProductCatalog()
+    return _catalog
+
+# To load products.csv into the 'products' collection in MongoDB, run
+# catalog_ingest.py
@@ -0,0 +1,289 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import connection, shared_memory
+
+import numpy as np
+
+import metrics
+
+# Seconds between a worker's metric updates to the server
+METRICS_INTERVAL = 1.0
+# Seconds between checks for worker processes that died and for close()
+WATCH_INTERVAL = 1.0
+
+
+def _worker_main(requests, results, roi_compositing, blend_mode, landmark_options):
+    # Runs in a spawned process: imports the render stack once and keeps one
+    # landmark engine / compositor per session so FaceMesh tracking survives
+    # between frames.
+    from landmark_scheduler import create_landmark_engine
+    from utils import create_compositor, process_frame, process_yuv_frame
+
+    sessions = {}
+    metrics_sent = time.monotonic()
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        kind, session_id = message[0], message[1]
+        if kind == "close":
+            state = sessions.pop(session_id, None)
+            if state:
+                state["engine"].close()
+                if state["shm"] is not None:
+                    state["shm"].close()
+            continue
+
+        shm_name, shape, frame_format, plan, seq = message[2:]
+        state = sessions.get(session_id)
+        if state is None:
+            state = sessions[session_id] = {
+                "engine": create_landmark_engine(**landmark_options),
+                "compositor": create_compositor(roi_compositing, blend_mode),
+                "shm": None,
+                "plan": None,
+            }
+        if plan is not None:
+            # sent with the first frame and again only when the settings change
+            state["plan"] = plan
+        if state["shm"] is None or state["shm"].name != shm_name:
+            # the parent reallocates the block when the frame size grows or a
+            # frame times out
+            if state["shm"] is not None:
+                state["shm"].close()
+                state["shm"] = None
+            try:
+                state["shm"] = shared_memory.SharedMemory(name=shm_name)
+            except FileNotFoundError:
+                # the parent released the block (session closed, or a newer
+                # block replaced it) while this frame was queued
+                results.send((session_id, seq, False, None))
+                continue
+        frame = np.ndarray(shape, dtype=np.uint8, buffer=state["shm"].buf)
+        try:
+            render = process_yuv_frame if frame_format == "yuv" else process_frame
+            processed = render(frame, state["plan"], state["engine"], state["compositor"])
+            if processed is not frame:
+                frame[...] = processed
+            ok = True
+        except Exception:
+            ok = False
+        # stage timings recorded in this process, batched to keep results small
+        deltas = None
+        if time.monotonic() - metrics_sent >= METRICS_INTERVAL:
+            deltas = metrics.take_deltas()
+            metrics_sent = time.monotonic()
+        results.send((session_id, seq, ok, deltas))
+
+    for state in sessions.values():
+        state["engine"].close()
+        if state["shm"] is not None:
+            state["shm"].close()
+
+
+class RenderSession:
+    """One WebRTC track's handle on the pool.
+
+    Pinned to a single worker so that worker's FaceMesh keeps tracking the
+    face. Frames travel through a shared-memory block owned by the session:
+    the worker renders in place and only a small tuple crosses the queues.
+    """
+
+    def __init__(self, pool, session_id: int, worker: int):
+        self.pool = pool
+        self.session_id = session_id
+        self.worker = worker
+        self._shm = None
+        self._seq = itertools.count()
+        # the RenderPlan the worker last received, and which incarnation of
+        # the worker received it (a respawned worker starts without plans)
+        self._plan_sent = None
+        self._generation = 0
+        self.closed = False
+
+    def _frame_buffer(self, shape: tuple) -> np.array:
+        size = int(np.prod(shape))
+        if self._shm is None or self._shm.size < size:
+            if self._shm is not None:
+                _release(self._shm)
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf)
+
+    async def render(self, img: np.array, plan, frame_format: str = "bgr"):
+        # returns the rendered frame, or None when the frame was dropped;
+        # plan is a utils.RenderPlan; frame_format "yuv" is an I420 frame for
+        # process_yuv_frame()
+        if self.closed:
+            return None
+        return await self.pool._render(self, img, plan, frame_format)
+
+    def _drop_buffer(self):
+        # the next frame gets a new block; the worker may keep rendering into
+        # this one, which lives on until both sides have closed it
+        if self._shm is not None:
+            _release(self._shm)
+            self._shm = None
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.pool._close_session(self)
+        self._drop_buffer()
+
+
+class RenderPool:
+    """Process pool that renders makeup frames outside the API process.
+
+    Each worker process owns its own FaceMesh instances, so landmark inference
+    and mask building no longer contend for the server's GIL. At most
+    max_pending frames are outstanding per worker; beyond that render() drops
+    the frame instead of queueing it, and the caller moves on to a newer one.
+    A worker that dies is respawned: its sessions keep their slot and get a
+    fresh FaceMesh, and their frames in flight come back unrendered.
+    """
+
+    def __init__(self, workers: int, max_pending: int = 2, timeout: float = 1.0, roi_compositing: bool = True, blend_mode: str = "alpha", landmark_options: dict = None):
+        self._context = mp.get_context("spawn")
+        self._worker_args = (roi_compositing, blend_mode, landmark_options or {})
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._requests = [None] * workers
+        self._results = [None] * workers
+        self._processes = [None] * workers
+        self._generations = [0] * workers
+        for worker in range(workers):
+            self._spawn(worker)
+        self._pending = [0] * workers
+        self._sessions = [0] * workers
+        self._session_ids = itertools.count()
+        self._futures = {}
+        self._closing = False
+        self._listener = threading.Thread(target=self._drain_results, daemon=True)
+        self._listener.start()
+
+    def _spawn(self, worker: int):
+        # Each worker gets its own request queue and result pipe, so a worker
+        # killed while holding a queue lock cannot stall the others or its
+        # replacement
+        requests = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_worker_main, args=(requests, writer) + self._worker_args, daemon=True)
+        process.start()
+        writer.close()
+        self._requests[worker] = requests
+        self._results[worker] = reader
+        self._processes[worker] = process
+        self._generations[worker] += 1
+
+    def open_session(self) -> RenderSession:
+        worker = min(range(len(self._processes)), key=lambda i: self._sessions[i])
+        self._sessions[worker] += 1
+        return RenderSession(self, next(self._session_ids), worker)
+
+    async def _render(self, session: RenderSession, img: np.array, plan, frame_format: str):
+        worker = session.worker
+        if self._pending[worker] >= self.max_pending:
+            return None
+        frame = session._frame_buffer(img.shape)
+        np.copyto(frame, img)
+        seq = next(session._seq)
+        key = (session.session_id, seq)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[key] = (loop, future, worker)
+        self._pending[worker] += 1
+        try:
+            # plans are immutable, so one that has not changed is not pickled
+            # again: the worker keeps the last one it was sent
+            generation = self._generations[worker]
+            changed = plan is not session._plan_sent or session._generation != generation
+            self._requests[worker].put(("render", session.session_id, session._shm.name, img.shape, frame_format, plan if changed else None, seq))
+            session._plan_sent, session._generation = plan, generation
+            ok = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            # the worker still owns the block until it answers this frame, so
+            # writing the next frame into it would race its late result
+            session._drop_buffer()
+            return None
+        finally:
+            self._pending[worker] -= 1
+            self._futures.pop(key, None)
+        return frame if ok else img
+
+    def _drain_results(self):
+        # answers frames as the workers finish them, and respawns workers
+        # whose process died
+        while not self._closing:
+            readers = {reader: worker for worker, reader in enumerate(self._results)}
+            sentinels = {process.sentinel: worker for worker, process in enumerate(self._processes)}
+            for ready in connection.wait(list(readers) + list(sentinels), timeout=WATCH_INTERVAL):
+                if ready in readers:
+                    try:
+                        self._answer(ready.recv())
+                    except EOFError:
+                        # the worker exited; its sentinel is ready too
+                        pass
+                elif not self._closing:
+                    self._respawn(sentinels[ready])
+
+    def _answer(self, result: tuple):
+        session_id, seq, ok, deltas = result
+        if deltas:
+            metrics.merge_deltas(deltas)
+        entry = self._futures.get((session_id, seq))
+        if entry:
+            loop, future, _ = entry
+            loop.call_soon_threadsafe(_set_result, future, ok)
+
+    def _respawn(self, worker: int):
+        process, old_requests, old_results = self._processes[worker], self._requests[worker], self._results[worker]
+        process.join(timeout=1)
+        print(f"Render worker {worker} exited with code {process.exitcode}, restarting it")
+        # results it sent before dying still count
+        try:
+            while old_results.poll():
+                self._answer(old_results.recv())
+        except EOFError:
+            pass
+        self._spawn(worker)
+        old_results.close()
+        old_requests.cancel_join_thread()
+        old_requests.close()
+        # the rest of its frames in flight will never be answered
+        for loop, future, owner in list(self._futures.values()):
+            if owner == worker:
+                loop.call_soon_threadsafe(_set_result, future, False)
+
+    def _close_session(self, session: RenderSession):
+        self._sessions[session.worker] -= 1
+        self._requests[session.worker].put(("close", session.session_id))
+
+    def close(self):
+        self._closing = True
+        self._listener.join(timeout=WATCH_INTERVAL + 1)
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for reader in self._results:
+            reader.close()
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _release(shm):
+    shm.unlink()
+    try:
+        shm.close()
+    except BufferError:
+        # a returned frame still views the block; the mapping goes with it
+        pass
@@ -0,0 +1,271 @@
+"""Batch makeup renderer for recorded clips.
+
+Streams each input through decode -> landmarks -> composite -> encode. Every
+stage runs on its own thread (compositing on a pool of --workers threads, all
+presets per frame), and the stages are linked by queues of --queue-size
+frames, so a slow stage applies backpressure instead of buffering the clip.
+FaceMesh runs once per frame in streaming mode, as for a live session, and
+the landmarks are shared by every preset.
+
+Presets use the WebRTC makeup message format, keyed by name:
+
+    {"evening": {"selectedMakeup": {"LIP_UPPER": "#7A0019", ...}, "blendIntensity": 0.3}}
+
+Prints frames per second and per-stage latency per clip.
+
+    python render_video.py sample/output_video.mp4 --presets presets.json --out-dir rendered --json stats.json
+"""
+import argparse
+import json
+import os
+import queue
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from landmark_scheduler import create_landmark_engine
+from utils import BLEND_MODES, DEFAULT_MAKEUP, compile_render_plan, composite_frame, create_compositor
+
+DEFAULT_INTENSITY = 0.2
+STAGES = ["decode", "landmarks", "composite", "encode"]
+
+
+class StageStats:
+    # per-frame busy time of one pipeline stage
+    def __init__(self):
+        self.samples = []
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"frames": 0}
+        ordered = sorted(self.samples)
+        return {
+            "frames": len(ordered),
+            "mean_ms": statistics.fmean(ordered) * 1000,
+            "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
+
+
+class Pipeline:
+    """One clip through the four stages.
+
+    A stage that fails sets `stop`, which makes every other stage give up on
+    its blocked put()/get(); run() then re-raises the first error.
+    """
+
+    def __init__(self, source: str, outputs: dict, presets: dict, workers: int, queue_size: int, roi_compositing: bool, landmark_options: dict, blend_mode: str = "alpha"):
+        self.source = source
+        self.outputs = outputs
+        self.presets = presets
+        self.workers = workers
+        self.roi_compositing = roi_compositing
+        self.blend_mode = blend_mode
+        self.landmark_options = landmark_options
+        self.decoded = queue.Queue(queue_size)
+        self.landmarked = queue.Queue(queue_size)
+        self.composited = queue.Queue(queue_size)
+        self.stats = {stage: StageStats() for stage in STAGES}
+        self.stop = threading.Event()
+        self.errors = []
+        self.frames = 0
+        self.fps = 30.0
+        self._local = threading.local()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _stage(self, fn):
+        def run():
+            try:
+                fn()
+            except Exception as e:
+                self.errors.append(e)
+                self.stop.set()
+        return threading.Thread(target=run, name=fn.__name__, daemon=True)
+
+    def decode(self):
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise RuntimeError(f"Could not open {self.source}")
+        # set before the first frame is queued, so the encoder sees it
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or self.fps
+        try:
+            while True:
+                start = time.perf_counter()
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self.stats["decode"].record(time.perf_counter() - start)
+                if not self._put(self.decoded, frame):
+                    return
+        finally:
+            capture.release()
+            self._put(self.decoded, None)
+
+    def landmarks(self):
+        engine = create_landmark_engine(**self.landmark_options)
+        try:
+            while (frame := self._get(self.decoded)) is not None:
+                start = time.perf_counter()
+                landmarks, valid = engine.read_array(frame)
+                self.stats["landmarks"].record(time.perf_counter() - start)
+                if not self._put(self.landmarked, (frame, landmarks, valid)):
+                    return
+        finally:
+            engine.close()
+            self._put(self.landmarked, None)
+
+    def _composite(self, frame, landmarks, valid) -> list:
+        start = time.perf_counter()
+        # one compositor per thread for its buffers (the tables are in each
+        # preset's plan); the frames themselves are fresh arrays since they
+        # wait for the encoder
+        if not hasattr(self._local, "compositor"):
+            self._local.compositor = create_compositor(self.roi_compositing, self.blend_mode)
+        compositor = self._local.compositor
+        rendered = []
+        for plan in self.presets.values():
+            if landmarks is None or not valid.any():
+                rendered.append(frame)
+            else:
+                output = np.empty_like(frame) if compositor is not None else None
+                rendered.append(composite_frame(frame, landmarks, valid, plan, compositor, output))
+        self.stats["composite"].record(time.perf_counter() - start)
+        return rendered
+
+    def composite(self):
+        # submit in frame order and queue the futures, so the encoder can
+        # take results in order while several frames composite at once
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="composite") as pool:
+            try:
+                while (item := self._get(self.landmarked)) is not None:
+                    if not self._put(self.composited, pool.submit(self._composite, *item)):
+                        return
+            finally:
+                self._put(self.composited, None)
+
+    def encode(self):
+        writers = None
+        try:
+            while (future := self._get(self.composited)) is not None:
+                rendered = future.result()
+                start = time.perf_counter()
+                if writers is None:
+                    writers = [self._writer(path, rendered[0].shape) for path in self.outputs.values()]
+                for writer, frame in zip(writers, rendered):
+                    writer.write(frame)
+                self.stats["encode"].record(time.perf_counter() - start)
+                self.frames += 1
+        finally:
+            for writer in writers or []:
+                writer.release()
+
+    def _writer(self, path: str, shape: tuple):
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (shape[1], shape[0]))
+        if not writer.isOpened():
+            raise RuntimeError(f"Could not open {path} for writing")
+        return writer
+
+    def run(self) -> dict:
+        threads = [self._stage(fn) for fn in (self.decode, self.landmarks, self.composite, self.encode)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if self.errors:
+            raise self.errors[0]
+        return {
+            "source": self.source,
+            "outputs": self.outputs,
+            "frames": self.frames,
+            "seconds": elapsed,
+            "fps": self.frames / elapsed if elapsed else 0.0,
+            "output_fps": self.frames * len(self.presets) / elapsed if elapsed else 0.0,
+            "stages": {stage: stats.summary() for stage, stats in self.stats.items()},
+        }
+
+
+def load_presets(path: str) -> dict:
+    # name -> RenderPlan, compiled once for the whole clip
+    if path is None:
+        return {"default": compile_render_plan(DEFAULT_MAKEUP, DEFAULT_INTENSITY)}
+    with open(path) as f:
+        presets = json.load(f)
+    return {name: compile_render_plan(preset.get("selectedMakeup", DEFAULT_MAKEUP), preset.get("blendIntensity", DEFAULT_INTENSITY)) for name, preset in presets.items()}
+
+
+def print_report(result: dict):
+    print(f"{result['source']}: {result['frames']} frames in {result['seconds']:.2f} s, "
+          f"{result['fps']:.1f} fps ({result['output_fps']:.1f} output frames/s)")
+    print(f"  {'stage':<12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for stage, summary in result["stages"].items():
+        if summary["frames"]:
+            print(f"  {stage:<12}{summary['mean_ms']:>10.2f}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}{summary['max_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="video files to render")
+    parser.add_argument("--presets", help="JSON file of makeup presets (default: the built-in look)")
+    parser.add_argument("--out-dir", default="rendered")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="compositing threads")
+    parser.add_argument("--queue-size", type=int, default=8, help="frames buffered between stages")
+    parser.add_argument("--blend-mode", choices=BLEND_MODES, default="alpha", help="alpha: label map + lookup tables; additive: the original mask")
+    parser.add_argument("--full-frame", action="store_true", help="additive mode: composite the whole frame instead of the face box")
+    parser.add_argument("--landmark-interval", type=int, default=1, help="run FaceMesh at most every N frames, tracking in between (1: every frame)")
+    parser.add_argument("--inference-size", type=int, default=0, help="resize frames to this short side for FaceMesh (0: full resolution)")
+    parser.add_argument("--json", help="write the stats to this file")
+    args = parser.parse_args()
+
+    presets = load_presets(args.presets)
+    os.makedirs(args.out_dir, exist_ok=True)
+    results = []
+    for source in args.inputs:
+        stem = os.path.splitext(os.path.basename(source))[0]
+        outputs = {name: os.path.join(args.out_dir, f"{stem}_{name}.mp4") for name in presets}
+        pipeline = Pipeline(
+            source,
+            outputs,
+            presets,
+            workers=args.workers,
+            queue_size=args.queue_size,
+            roi_compositing=not args.full_frame,
+            landmark_options={"max_interval": args.landmark_interval, "inference_size": args.inference_size},
+            blend_mode=args.blend_mode,
+        )
+        result = pipeline.run()
+        print_report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(contents: bytes, namespace: str = "") -> str:
+    # identical uploads share a key; namespace separates incompatible settings
+    digest = hashlib.blake2b(contents, digest_size=16).hexdigest()
+    return f"{namespace}:{digest}" if namespace else digest
+
+
+class SqliteStore:
+    """On-disk key/value store shared by every process that opens the same file.
+
+    Values are strings and expire after ttl seconds. Writes use WAL mode so
+    readers in other workers are not blocked. Every purge_every writes, and
+    on open, expired rows are deleted and the table is cut back to
+    max_entries (0 for no cap) by dropping the rows closest to expiry, which
+    are the least recently written.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int = 0, purge_every: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_expires ON results (expires)")
+        self.purge()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM results WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, value, time.time() + self.ttl))
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._purge()
+
+    def purge(self):
+        with self._lock:
+            self._purge()
+
+    def _purge(self):
+        self._db.execute("DELETE FROM results WHERE expires <= ?", (time.time(),))
+        if self.max_entries > 0:
+            self._db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ResultCache:
+    """Bounded LRU cache with a TTL, optionally backed by a shared store.
+
+    Lookups check memory first, then the store (whose hits are copied into
+    memory). get_or_compute() also coalesces concurrent misses for one key,
+    so a retried upload that arrives while the first is still running waits
+    for that result instead of starting a second computation. Must be used
+    from a single event loop.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, store: SqliteStore = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+        return None
+
+    def set(self, key: str, value: str):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key: str, compute):
+        # compute is an async callable returning a str; returns (value, hit)
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value, True
+        while key in self._inflight:
+            inflight = self._inflight[key]
+            try:
+                value = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # the request computing it was cancelled; take over
+                continue
+            self.hits += 1
+            return value, True
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if self.store is not None:
+                try:
+                    value = await asyncio.to_thread(self.store.get, key)
+                except Exception as e:
+                    print(f"Error reading result cache store: {e}")
+                if value is not None:
+                    self.hits += 1
+                    self.store_hits += 1
+                    self.set(key, value)
+                    future.set_result(value)
+                    return value, True
+            self.misses += 1
+            value = await compute()
+            self.set(key, value)
+            future.set_result(value)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # nobody may be waiting on the future; don't log it as unretrieved
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.set, key, value)
+            except Exception as e:
+                print(f"Error writing result cache store: {e}")
+        return value, False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "store_hits": self.store_hits,
+            "hit_ratio": self.hits / lookups if lookups else None,
+        }
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
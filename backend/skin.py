@@ -1,36 +1,59 @@
 import torch
 import torchvision.models as models
 import torchvision.transforms as transforms
-from PIL import Image
+from PIL import Image, ImageOps
+from io import BytesIO
+import numpy as np
 import torch.nn as nn
 import pandas as pd
 import random
+import asyncio
+import os
+import threading
+import time
+
+from metrics import STAGE_SECONDS
 
 # Define class names for skin tone detection.
 class_names = ['dark', 'light', 'mid_dark', 'mid_light']
 
-# Load the MobileNetV2 model (customized for skin tone detection).
-try:
-    model = models.mobilenet_v2(pretrained=False)
-    num_ftrs = model.classifier[1].in_features
-    model.classifier = nn.Sequential(
-        nn.Dropout(0.7),
-        nn.Linear(num_ftrs, 50),
-        nn.ReLU(),
-        nn.Dropout(0.5),
-        nn.Linear(50, 4)
-    )
-except Exception as e:
-    raise RuntimeError(f"Error defining model architecture: {e}")
-
-# Load model state dict and set model to eval mode.
-try:
-    model_path = 'trained_model.pth'
-    state_dict = torch.load(model_path, map_location=torch.device('cpu'))
-    model.load_state_dict(state_dict)
-    model.eval()
-except Exception as e:
-    raise RuntimeError(f"Error loading model state dict from {model_path}: {e}")
+model_path = 'trained_model.pth'
+
+def build_model() -> nn.Module:
+    # Load the MobileNetV2 model (customized for skin tone detection).
+    try:
+        model = models.mobilenet_v2(pretrained=False)
+        num_ftrs = model.classifier[1].in_features
+        model.classifier = nn.Sequential(
+            nn.Dropout(0.7),
+            nn.Linear(num_ftrs, 50),
+            nn.ReLU(),
+            nn.Dropout(0.5),
+            nn.Linear(50, 4)
+        )
+    except Exception as e:
+        raise RuntimeError(f"Error defining model architecture: {e}")
+
+    # Load model state dict and set model to eval mode.
+    try:
+        state_dict = torch.load(model_path, map_location=torch.device('cpu'))
+        model.load_state_dict(state_dict)
+        model.eval()
+    except Exception as e:
+        raise RuntimeError(f"Error loading model state dict from {model_path}: {e}")
+    return model
+
+# The model is built on first use rather than at import
+_model = None
+_inference_model = None
+_model_lock = threading.RLock()
+
+def get_model() -> nn.Module:
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = build_model()
+    return _model
 
 # Define image transformations.
 transform = transforms.Compose([
@@ -39,18 +62,220 @@ transform = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
+# Inference backend: "eager" runs get_model(); the others load artifacts
+# written by skin_export.py
+MODEL_BACKEND = os.getenv("SKIN_MODEL_BACKEND", "eager")
+MODEL_ARTIFACTS = {
+    "torchscript": "skin_model.ts",
+    "torchscript-int8": "skin_model_int8.ts",
+    "onnx": "skin_model.onnx",
+    "onnx-int8": "skin_model_int8.onnx",
+}
+
+class OnnxModel:
+    # ONNX Runtime session with the same tensor-in, logits-out call as the model
+    def __init__(self, path: str):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("SKIN_MODEL_BACKEND=onnx* needs onnxruntime, which is not in requirements.txt: pip install onnxruntime")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, image_tensors: torch.Tensor) -> torch.Tensor:
+        output = self.session.run(None, {self.input_name: image_tensors.numpy()})[0]
+        return torch.from_numpy(output)
+
+def load_inference_model(backend: str = MODEL_BACKEND):
+    if backend == "eager":
+        return get_model()
+    if backend not in MODEL_ARTIFACTS:
+        raise RuntimeError(f"Unknown skin model backend {backend!r}; expected eager or one of {sorted(MODEL_ARTIFACTS)}")
+    path = MODEL_ARTIFACTS[backend]
+    try:
+        if backend.startswith("torchscript"):
+            return torch.jit.load(path, map_location=torch.device('cpu'))
+        return OnnxModel(path)
+    except ImportError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error loading {backend} skin model from {path} (run skin_export.py first): {e}")
+
+def get_inference_model():
+    global _inference_model
+    with _model_lock:
+        if _inference_model is None:
+            _inference_model = load_inference_model()
+    return _inference_model
+
+# Intra-op threads for CPU inference (0 keeps torch's default)
+TORCH_NUM_THREADS = int(os.getenv("SKIN_TORCH_THREADS", "0"))
+if TORCH_NUM_THREADS > 0:
+    torch.set_num_threads(TORCH_NUM_THREADS)
+
+# Uploads: images with more pixels than SKIN_MAX_INPUT_PIXELS are rejected
+# from the header alone; JPEGs are decoded at a reduced DCT scale (PIL draft)
+# and everything is downscaled so its longer side is at most SKIN_DECODE_SIZE
+MAX_INPUT_PIXELS = int(os.getenv("SKIN_MAX_INPUT_PIXELS", str(40_000_000)))
+DECODE_SIZE = int(os.getenv("SKIN_DECODE_SIZE", "640"))
+# Classify the forehead-to-cheeks box instead of the whole picture (0 disables)
+FACE_CROP = os.getenv("SKIN_FACE_CROP", "1") != "0"
+# Forehead, cheekbone and mid-cheek landmarks; their bounding box is the crop
+SKIN_REGION_POINTS = np.array([10, 67, 109, 297, 338, 116, 345, 50, 280, 205, 425], dtype=np.intp)
+# Crops are squared and resampled to this size, so every cropped upload has
+# the same tensor shape and SkinToneBatcher can stack them into one batch
+CROP_SIZE = 224
+
+def result_namespace() -> str:
+    # settings that change the prediction for the same upload bytes
+    return f"{MODEL_BACKEND}:{DECODE_SIZE}:{CROP_SIZE if FACE_CROP else 0}"
+
+def load_image(contents: bytes) -> Image.Image:
+    image = Image.open(BytesIO(contents))
+    width, height = image.size
+    if width * height > MAX_INPUT_PIXELS:
+        raise ValueError(f"Image is {width}x{height}; at most {MAX_INPUT_PIXELS} pixels are accepted")
+    image.draft("RGB", (DECODE_SIZE, DECODE_SIZE))
+    image = image.convert("RGB")
+    image.thumbnail((DECODE_SIZE, DECODE_SIZE))
+    # phone photos are stored sideways with an EXIF orientation tag
+    return ImageOps.exif_transpose(image)
+
+# Static-image FaceMesh shared by all uploads (it keeps no per-image state;
+# its lock serializes concurrent calls)
+_face_engine = None
+
+def get_face_engine():
+    global _face_engine
+    from utils import LandmarkEngine
+    with _model_lock:
+        if _face_engine is None:
+            _face_engine = LandmarkEngine(static_image_mode=True)
+    return _face_engine
+
+def square_box(box: tuple, width: int, height: int) -> tuple:
+    # grow the short side of (x0, y0, x1, y1) around its centre to match the
+    # long side, shifted (and at worst clipped) to stay inside the image
+    x0, y0, x1, y1 = box
+    side = min(max(x1 - x0, y1 - y0), width, height)
+    x0 = min(max(0, (x0 + x1 - side) // 2), width - side)
+    y0 = min(max(0, (y0 + y1 - side) // 2), height - side)
+    return x0, y0, x0 + side, y0 + side
+
+def crop_skin_region(image: Image.Image) -> Image.Image:
+    # a CROP_SIZE square around the skin landmarks, or the whole image when
+    # no face is found
+    from utils import face_bbox, read_landmark_array
+    landmarks, valid = read_landmark_array(np.asarray(image), get_face_engine())
+    if landmarks is None:
+        return image
+    box = face_bbox(landmarks[SKIN_REGION_POINTS], valid[SKIN_REGION_POINTS], (image.height, image.width), padding=0)
+    if box is None:
+        return image
+    return image.resize((CROP_SIZE, CROP_SIZE), Image.BILINEAR, box=square_box(box, image.width, image.height))
+
+def prepare_upload(contents: bytes) -> Image.Image:
+    # decode, limit and (optionally) face-crop an uploaded image for prediction
+    with STAGE_SECONDS.time(stage="beautify_decode"):
+        image = load_image(contents)
+    if FACE_CROP:
+        with STAGE_SECONDS.time(stage="beautify_face_crop"):
+            image = crop_skin_region(image)
+    return image
+
+def preprocess_image(image: Image.Image) -> torch.Tensor:
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return transform(image)
+
+def predict_batch(image_tensors: torch.Tensor, classifier=None) -> list:
+    # image_tensors: (N, 3, H, W) from preprocess_image, all the same size
+    classifier = classifier or get_inference_model()
+    start = time.perf_counter()
+    with torch.no_grad():
+        output = classifier(image_tensors)
+        _, predicted = torch.max(output, 1)
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="beautify_inference")
+    return [class_names[i] for i in predicted.tolist()]
+
 def predict_skin_tone(image: Image.Image) -> str:
     try:
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        image_tensor = transform(image).unsqueeze(0)
-        with torch.no_grad():
-            output = model(image_tensor)
-            _, predicted = torch.max(output, 1)
-        return class_names[predicted.item()]
+        return predict_batch(preprocess_image(image).unsqueeze(0))[0]
     except Exception as e:
         raise RuntimeError(f"Error during skin tone prediction: {e}")
 
+class SkinToneBatcher:
+    """Micro-batches concurrent skin tone predictions.
+
+    predict() preprocesses its image on a worker thread and queues the tensor.
+    A collector task waits up to max_wait seconds (or until max_batch images
+    are queued), stacks same-sized tensors into one batch and runs a single
+    model call on a worker thread, then resolves every waiting future. Face
+    crops are all CROP_SIZE squares; Resize keeps the aspect ratio of
+    uncropped images, so those run in separate batches per shape.
+    """
+
+    def __init__(self, max_batch: int = 8, max_wait: float = 0.005):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = None
+        self._collector = None
+
+    def start(self):
+        if self._collector is None:
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+
+    async def predict(self, image: Image.Image) -> str:
+        self.start()
+        image_tensor = await asyncio.to_thread(preprocess_image, image)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image_tensor, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(pending) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            groups = {}
+            for image_tensor, future in pending:
+                groups.setdefault(tuple(image_tensor.shape), []).append((image_tensor, future))
+            for group in groups.values():
+                await self._run(group)
+
+    async def _run(self, group):
+        try:
+            labels = await asyncio.to_thread(predict_batch, torch.stack([image_tensor for image_tensor, _ in group]))
+        except Exception as e:
+            error = RuntimeError(f"Error during skin tone prediction: {e}")
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), label in zip(group, labels):
+            if not future.done():
+                future.set_result(label)
+
 # Updated product recommendation data including Eyeshadow.
 data = {
     "Skin Tone": ["light", "mid_light", "mid_dark", "dark"],
@@ -0,0 +1,137 @@
+"""Export the skin tone classifier to optimized CPU artifacts.
+
+Writes the files that SKIN_MODEL_BACKEND selects in skin.py:
+
+    torchscript       skin_model.ts         traced, frozen fp32 TorchScript
+    torchscript-int8  skin_model_int8.ts    FX static int8, calibrated on --calibration images
+    onnx              skin_model.onnx       fp32 ONNX (batch, height and width are dynamic)
+    onnx-int8         skin_model_int8.onnx  ONNX Runtime int8 (static by default, --dynamic-onnx for dynamic)
+
+    python skin_export.py --backends torchscript onnx onnx-int8
+
+The ONNX backends need onnx and onnxruntime, which are not in
+requirements.txt (the server only uses onnxruntime with
+SKIN_MODEL_BACKEND=onnx*):
+
+    pip install onnx onnxruntime
+"""
+import argparse
+import copy
+import glob
+import importlib.util
+import os
+
+import torch
+from PIL import Image
+
+from skin import MODEL_ARTIFACTS, get_model, preprocess_image
+
+CALIBRATION_DIR = "sample"
+IMAGE_PATTERNS = ("*.png", "*.jpg", "*.jpeg")
+# optional packages the ONNX backends need
+ONNX_PACKAGES = ("onnx", "onnxruntime")
+
+
+def require_onnx():
+    missing = [name for name in ONNX_PACKAGES if importlib.util.find_spec(name) is None]
+    if missing:
+        raise SystemExit(f"The ONNX backends need {' and '.join(missing)}: pip install {' '.join(ONNX_PACKAGES)}")
+
+
+def calibration_tensors(directory: str = CALIBRATION_DIR) -> list:
+    # one (1, 3, H, W) tensor per sample image, preprocessed like /beautify
+    paths = sorted(path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(directory, pattern)))
+    if not paths:
+        raise SystemExit(f"No calibration images found in {directory}")
+    return [preprocess_image(Image.open(path)).unsqueeze(0) for path in paths]
+
+
+def export_torchscript(path: str, example: torch.Tensor):
+    with torch.no_grad():
+        traced = torch.jit.trace(get_model(), example)
+        # optimize_for_inference() output does not survive save/load, so the
+        # frozen graph is stored and optimized by the JIT at load time
+        frozen = torch.jit.freeze(traced)
+    frozen.save(path)
+
+
+def export_torchscript_int8(path: str, calibration: list):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    float_model = copy.deepcopy(get_model()).eval()
+    prepared = prepare_fx(float_model, get_default_qconfig_mapping(torch.backends.quantized.engine), (calibration[0],))
+    with torch.no_grad():
+        for image_tensor in calibration:
+            prepared(image_tensor)
+        quantized = convert_fx(prepared)
+        traced = torch.jit.freeze(torch.jit.trace(quantized, calibration[0]))
+    traced.save(path)
+
+
+def export_onnx(path: str, example: torch.Tensor):
+    torch.onnx.export(
+        get_model(),
+        example,
+        path,
+        input_names=["image"],
+        output_names=["logits"],
+        dynamic_axes={"image": {0: "batch", 2: "height", 3: "width"}, "logits": {0: "batch"}},
+        opset_version=17,
+    )
+
+
+class _CalibrationReader:
+    # onnxruntime.quantization.CalibrationDataReader over the sample images
+    def __init__(self, calibration: list):
+        self._inputs = iter([{"image": image_tensor.numpy()} for image_tensor in calibration])
+
+    def get_next(self):
+        return next(self._inputs, None)
+
+
+def export_onnx_int8(path: str, fp32_path: str, calibration: list, dynamic: bool = False):
+    from onnxruntime.quantization import QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if not os.path.exists(fp32_path):
+        export_onnx(fp32_path, calibration[0])
+    prepared_path = path + ".prep.onnx"
+    quant_pre_process(fp32_path, prepared_path)
+    try:
+        if dynamic:
+            quantize_dynamic(prepared_path, path, weight_type=QuantType.QInt8)
+        else:
+            quantize_static(prepared_path, path, _CalibrationReader(calibration), activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    finally:
+        os.remove(prepared_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=sorted(MODEL_ARTIFACTS), default=sorted(MODEL_ARTIFACTS))
+    parser.add_argument("--calibration", default=CALIBRATION_DIR, help="directory of images for int8 calibration")
+    parser.add_argument("--dynamic-onnx", action="store_true", help="dynamic instead of static ONNX int8 quantization")
+    args = parser.parse_args()
+    if any(backend.startswith("onnx") for backend in args.backends):
+        # fail before spending time on the TorchScript exports
+        require_onnx()
+
+    calibration = calibration_tensors(args.calibration)
+    example = calibration[0]
+    for backend in args.backends:
+        path = MODEL_ARTIFACTS[backend]
+        if backend == "torchscript":
+            export_torchscript(path, example)
+        elif backend == "torchscript-int8":
+            export_torchscript_int8(path, calibration)
+        elif backend == "onnx":
+            export_onnx(path, example)
+        elif backend == "onnx-int8":
+            export_onnx_int8(path, MODEL_ARTIFACTS["onnx"], calibration, dynamic=args.dynamic_onnx)
+        print(f"{backend}: wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+os.environ.setdefault("CATALOG_SOURCE", "csv")
+
+from fastapi.testclient import TestClient
+
+import api
+
+MAKEUP = {"LIP_UPPER": "#7A0019"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(api.app) as client:
+        yield client
+
+
+@pytest.mark.parametrize("params", [
+    {"page_size": 0},
+    {"page_size": -1},
+    {"page_size": "abc"},
+    {"page_size": 1.5},
+    {"page_size": 2, "page": -1},
+    {"page_size": 2, "page": None},
+    {"page_size": 2, "page": "abc"},
+    {"page_size": 2, "page": 1.5},
+    {"fields": ["nope"]},
+    {"fields": 5},
+    {"match": "nearest", "top_k": 0},
+    {"match": "nearest", "top_k": "abc"},
+    {"match": "nearest", "max_delta_e": "x"},
+])
+def test_products_rejects_malformed_params(client, params):
+    response = client.post("/products", json={"selectedMakeup": MAKEUP, **params})
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_products_requires_makeup(client):
+    assert client.post("/products", json={}).status_code == 400
+    assert client.post("/products", json=[]).status_code == 400
+
+
+def test_products_accepts_paging(client):
+    response = client.post("/products", json={"selectedMakeup": MAKEUP, "page_size": "2", "page": 0, "fields": "light"})
+    assert response.status_code == 200
+
+
+def test_csv_products_have_stable_ids(client):
+    body = {"selectedMakeup": MAKEUP, "fields": "light", "top_k": 5}
+    first = client.post("/products", json=body).json()["products"]
+    ids = [product["_id"] for found in first.values() for product in found]
+    assert ids and all(isinstance(_id, str) and _id for _id in ids)
+    assert len(set(ids)) == len(ids)
+    again = client.post("/products", json=body).json()["products"]
+    assert [product["_id"] for found in again.values() for product in found] == ids
+
+
+def test_assign_csv_ids_falls_back_to_row():
+    from product_utils import assign_csv_ids
+    docs = assign_csv_ids([{"id": 7}, {"id": None}, {"id": 7}])
+    assert [doc["_id"] for doc in docs] == ["7", "row-1", "row-2"]
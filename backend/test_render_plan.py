@@ -0,0 +1,62 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from utils import DEFAULT_MAKEUP, LandmarkEngine, blur_padding, compile_render_plan, composite_frame, create_compositor, face_bbox, face_point_indices
+
+SAMPLE_FACE = os.path.join(os.path.dirname(__file__), "sample", "face.png")
+
+
+@pytest.fixture(scope="module")
+def face():
+    image = cv2.imread(SAMPLE_FACE)
+    # even sides, as render_yuv() needs
+    image = np.ascontiguousarray(image[:image.shape[0] // 2 * 2, :image.shape[1] // 2 * 2])
+    with LandmarkEngine(static_image_mode=True) as engine:
+        landmarks, valid = engine.read_array(image)
+    assert landmarks is not None
+    return image, landmarks, valid
+
+
+def test_partial_makeup_compiles_only_given_regions():
+    plan = compile_render_plan({"LIP_UPPER": "#7A0019"}, 0.5)
+    assert len(plan.connections) == 1
+    assert np.array_equal(plan.connections[0], face_point_indices["LIP_UPPER"])
+    assert plan.colors == ((0x19, 0x00, 0x7A),)
+
+
+@pytest.mark.parametrize("blend_mode", ["alpha", "additive"])
+def test_partial_makeup_leaves_other_regions_untouched(face, blend_mode):
+    image, landmarks, valid = face
+    plan = compile_render_plan({"LIP_UPPER": "#7A0019"}, 0.5)
+    rendered = composite_frame(image, landmarks, valid, plan, create_compositor(True, blend_mode)).astype(np.int16)
+
+    lips = face_point_indices["LIP_UPPER"]
+    x0, y0, x1, y1 = face_bbox(landmarks[lips], valid[lips], image.shape, blur_padding(plan))
+    outside = np.ones(image.shape[:2], dtype=bool)
+    outside[y0:y1, x0:x1] = False
+    changed = np.abs(rendered - image).max(axis=2)
+    # the additive blend has always added 1 across the face box
+    assert changed[outside].max() <= (0 if blend_mode == "alpha" else 1)
+    assert changed[~outside].max() > 0
+
+
+def test_partial_makeup_yuv_matches_untouched_frame_outside_lips(face):
+    image, landmarks, valid = face
+    plan = compile_render_plan({"LIP_UPPER": "#7A0019"}, 0.5)
+    yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420)
+    rendered = create_compositor(True, "alpha").render_yuv(yuv, landmarks, valid, plan)
+
+    lips = face_point_indices["LIP_UPPER"]
+    x0, y0, x1, y1 = face_bbox(landmarks[lips], valid[lips], image.shape, blur_padding(plan))
+    height = image.shape[0]
+    luma_changed = rendered[:height] != yuv[:height]
+    luma_changed[y0:y1, x0:x1] = False
+    assert not luma_changed.any()
+
+
+def test_full_makeup_still_paints_every_region():
+    plan = compile_render_plan(DEFAULT_MAKEUP, 0.5)
+    assert len(plan.connections) == len(DEFAULT_MAKEUP)
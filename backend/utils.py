@@ -1,7 +1,12 @@
+import functools
+import threading
+import time
+from collections import namedtuple
 import numpy as np
-import mediapipe as mp
 import cv2
 
+from metrics import LANDMARK_FAILURES, STAGE_SECONDS
+
 
 # landmarks of features from mediapipe
 face_points={
@@ -20,9 +25,74 @@ face_points={
 "EYEBROW_RIGHT": [285, 336, 296, 334, 293, 300, 276, 283, 295, 285]
 }
 
-# initialize mediapipe functions
-mp_face_mesh = mp.solutions.face_mesh
-mp_drawing = mp.solutions.drawing_utils
+# makeup applied when a client does not pick its own
+DEFAULT_MAKEUP = {
+    "LIP_UPPER": "#AA0A1E",
+    "LIP_LOWER": "#AA0A1E",
+    "EYEBROW_LEFT": "#3B2F2F",
+    "EYEBROW_RIGHT": "#3B2F2F",
+    "EYELINER_LEFT": "#000000",
+    "EYELINER_RIGHT": "#000000",
+    "EYESHADOW_LEFT": "#660033",
+    "EYESHADOW_RIGHT": "#660033",
+    "BLUSH_LEFT": "#DF5B6F",
+    "BLUSH_RIGHT": "#DF5B6F",
+    "FOUNDATION": "#F1E7D5"
+}
+
+# blush gradient radius (fallback when the eyes are not found) and the blur
+# applied to the finished mask, in pixels
+BLUSH_RADIUS = 30
+# blush radius as a fraction of the outer eye corner distance, and its bounds
+BLUSH_RADIUS_RATIO = 0.2
+BLUSH_RADIUS_STEP = 4
+BLUSH_RADIUS_MIN = 8
+BLUSH_RADIUS_MAX = 96
+OUTER_EYE_CORNERS = (33, 263)
+MASK_BLUR_KERNEL = (7, 7)
+MASK_BLUR_SIGMA = 4
+# opacity of each kind of region; the blend intensity scales all of them
+FOUNDATION_ALPHA = 0.4
+BLUSH_ALPHA = 0.5
+REGION_ALPHA = 1.0
+BLEND_MODES = ("alpha", "additive")
+
+# the same regions as index arrays, so each region is a single gather;
+# read-only since render plans share them across threads
+face_point_indices = {name: np.array(points, dtype=np.intp) for name, points in face_points.items()}
+for _indices in face_point_indices.values():
+    _indices.flags.writeable = False
+
+# makeup regions in drawing order
+FACE_ELEMENTS = ["FOUNDATION", "LIP_LOWER", "LIP_UPPER", "EYEBROW_LEFT", "EYEBROW_RIGHT", "EYELINER_LEFT", "EYELINER_RIGHT", "EYESHADOW_LEFT", "EYESHADOW_RIGHT", "BLUSH_LEFT", "BLUSH_RIGHT"]
+
+# Everything the frame path needs from a session's makeup settings, compiled
+# once per change by compile_render_plan() and never mutated, so a session
+# swaps in a new plan with one assignment while frames render with the old.
+# colors: BGR tuples; connections: landmark index arrays; kinds/alphas: how
+# each region is drawn (region_kind()) and its opacity; label_tables: the
+# LabelMapCompositor lookup tables
+RenderPlan = namedtuple("RenderPlan", ["colors", "connections", "kinds", "alphas", "intensity", "blur_kernel", "blur_sigma", "label_tables"])
+# LabelMapCompositor tables: the packed index steps per region, index -> alpha
+# level, index -> 255 * (1 - alpha), index -> premultiplied colour per BGR and
+# per YUV channel, each region's YUV colour and the blush opacity
+LabelTables = namedtuple("LabelTables", ["levels", "alpha_lut", "inverse_lut", "bgr_luts", "yuv_luts", "yuv_colors", "blush_alpha", "dilate_kernel"])
+
+# mediapipe functions, imported on first use by load_mediapipe() since the
+# import alone takes most of a second
+mp_face_mesh = None
+mp_drawing = None
+_mediapipe_lock = threading.Lock()
+
+
+def load_mediapipe():
+    global mp_face_mesh, mp_drawing
+    with _mediapipe_lock:
+        if mp_face_mesh is None:
+            import mediapipe as mp
+            mp_drawing = mp.solutions.drawing_utils
+            mp_face_mesh = mp.solutions.face_mesh
+    return mp_face_mesh
 
 
 # to display image in cv2 window
@@ -33,36 +103,173 @@ def show_image(image: np.array, msg: str = "Loaded Image"):
     cv2.destroyAllWindows()
 
 
-def read_landmarks(image: np.array):
-    landmark_cordinates = {}
+class LandmarkEngine:
+    """Long-lived FaceMesh graph for a single video stream.
+
+    Runs in streaming mode so MediaPipe tracks the face between frames instead
+    of re-running detection, and keeps the graph alive across calls. One engine
+    must only serve one stream: tracking state is per-sequence.
+
+    With inference_size set, frames whose short side is larger are resized to
+    that short side (into a buffer reused across frames) before FaceMesh sees
+    them. The landmarks come back normalized, so read_array() still maps them
+    to full-resolution pixels for compositing.
+    """
+
+    def __init__(self, static_image_mode: bool = False, max_num_faces: int = 1, inference_size: int = 0):
+        self._face_mesh = load_mediapipe().FaceMesh(
+            static_image_mode=static_image_mode,
+            max_num_faces=max_num_faces,
+            refine_landmarks=True,
+        )
+        self.inference_size = inference_size
+        self._resized = None
+        # process() runs in worker threads while close() comes from the event loop
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def _inference_image(self, image: np.array) -> np.array:
+        height, width = image.shape[:2]
+        short_side = min(height, width)
+        if not self.inference_size or short_side <= self.inference_size:
+            return image
+        scale = self.inference_size / short_side
+        shape = (max(1, round(height * scale)), max(1, round(width * scale))) + image.shape[2:]
+        if self._resized is None or self._resized.shape != shape:
+            self._resized = np.empty(shape, dtype=image.dtype)
+        return cv2.resize(image, (shape[1], shape[0]), dst=self._resized, interpolation=cv2.INTER_LINEAR)
+
+    def process(self, image: np.array):
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("LandmarkEngine is closed")
+            results = self._face_mesh.process(self._inference_image(image))
+        if not results.multi_face_landmarks:
+            return None
+        return results.multi_face_landmarks[0].landmark
+
+    def read_array(self, image: np.array):
+        face_landmarks = self.process(image)
+        if face_landmarks is None:
+            return None, None
+        return landmarks_to_array(face_landmarks, image.shape[1], image.shape[0])
+
+    def close(self):
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self._face_mesh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def detect_face_landmarks(image: np.array, engine: LandmarkEngine = None):
     # load mediapipe facemesh and detect facial landmarks
     # face landmarks returns normalized points of all facial landmarks from 0 to 477
-    with mp_face_mesh.FaceMesh(refine_landmarks=True) as face_mesh:
-        results = face_mesh.process(image)
-        face_landmarks = results.multi_face_landmarks[0].landmark
+    if engine is not None:
+        return engine.process(image)
+    with LandmarkEngine(static_image_mode=True) as face_mesh:
+        return face_mesh.process(image)
+
 
+def landmarks_to_dict(face_landmarks, width: int, height: int) -> dict:
+    load_mediapipe()
+    landmark_cordinates = {}
     # convert normalized points w.r.to image dimensions
     for idx, landmark in enumerate(face_landmarks):
         landmark_px = mp_drawing._normalized_to_pixel_coordinates(
-            landmark.x, landmark.y, image.shape[1], image.shape[0]
+            landmark.x, landmark.y, width, height
         )
         # create a map of facial landmarks to (x,y) coordinates
         if landmark_px:
             landmark_cordinates[idx] = landmark_px
     return landmark_cordinates
 
-def draw_blush_gradient(mask: np.array, center: tuple, radius: int, color: list):
-    patch_size = 2 * radius + 1
-    # Create a grid of distances from the center of the patch
+
+def landmarks_to_array(face_landmarks, width: int, height: int):
+    # same mapping as mp_drawing._normalized_to_pixel_coordinates, done for all
+    # points at once: returns (N, 2) int32 (x, y) pixels and an (N,) validity mask
+    normalized = np.fromiter(
+        (value for landmark in face_landmarks for value in (landmark.x, landmark.y)),
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    valid = ((normalized >= 0) & (normalized <= 1)).all(axis=1)
+    coordinates = np.floor(normalized * (width, height))
+    np.clip(coordinates, 0, (width - 1, height - 1), out=coordinates)
+    return coordinates.astype(np.int32), valid
+
+
+def read_landmarks(image: np.array, engine: LandmarkEngine = None):
+    face_landmarks = detect_face_landmarks(image, engine)
+    if face_landmarks is None:
+        return {}
+    return landmarks_to_dict(face_landmarks, image.shape[1], image.shape[0])
+
+
+def read_landmark_array(image: np.array, engine: LandmarkEngine = None):
+    # engine is a LandmarkEngine or anything with the same read_array(), such
+    # as landmark_scheduler.LandmarkScheduler
+    if engine is not None:
+        return engine.read_array(image)
+    with LandmarkEngine(static_image_mode=True) as face_mesh:
+        return face_mesh.read_array(image)
+
+
+def region_points(idx_to_coordinates, connection, valid: np.array = None) -> np.array:
+    # landmark arrays are gathered with one fancy-index; dicts keep the old lookup
+    if isinstance(idx_to_coordinates, np.ndarray):
+        idx = np.asarray(connection, dtype=np.intp)
+        if valid is not None:
+            idx = idx[valid[idx]]
+        return idx_to_coordinates[idx]
+    return np.array([idx_to_coordinates[idx] for idx in connection if idx in idx_to_coordinates])
+
+
+def region_point(idx_to_coordinates, idx: int, valid: np.array = None):
+    if isinstance(idx_to_coordinates, np.ndarray):
+        if valid is not None and not valid[idx]:
+            return None
+        x, y = idx_to_coordinates[idx]
+        return int(x), int(y)
+    return idx_to_coordinates.get(idx)
+
+def blush_radius_for(idx_to_coordinates, valid: np.array = None) -> int:
+    # scale the blush with the face: a fraction of the distance between the
+    # outer eye corners, snapped to BLUSH_RADIUS_STEP so sprites stay cached
+    left = region_point(idx_to_coordinates, OUTER_EYE_CORNERS[0], valid)
+    right = region_point(idx_to_coordinates, OUTER_EYE_CORNERS[1], valid)
+    if not left or not right:
+        return BLUSH_RADIUS
+    distance = np.hypot(left[0] - right[0], left[1] - right[1])
+    radius = int(round(distance * BLUSH_RADIUS_RATIO / BLUSH_RADIUS_STEP)) * BLUSH_RADIUS_STEP
+    return min(max(radius, BLUSH_RADIUS_MIN), BLUSH_RADIUS_MAX)
+
+
+@functools.lru_cache(maxsize=32)
+def blush_kernel(radius: int) -> np.array:
+    # radial weight: 1 at the center and 0 at the edge
     y, x = np.ogrid[-radius:radius+1, -radius:radius+1]
     distance = np.sqrt(x*x + y*y)
-    # Compute a weight that is 1 at the center and 0 at the edge
     weight = np.clip(1 - distance / radius, 0, 1)
-    # Create a patch image for each color channel
-    patch = np.zeros((patch_size, patch_size, 3), dtype=np.uint8)
-    for c in range(3):
-        patch[:, :, c] = (color[c] * weight).astype(np.uint8)
-    
+    weight.flags.writeable = False
+    return weight
+
+
+@functools.lru_cache(maxsize=128)
+def blush_sprite(radius: int, color: tuple) -> np.array:
+    # colored gradient patch, built once per (radius, color)
+    patch = (blush_kernel(radius)[:, :, None] * np.array(color, dtype=np.float64)).astype(np.uint8)
+    patch.flags.writeable = False
+    return patch
+
+
+def clip_patch(shape: tuple, center: tuple, radius: int):
+    # (mask slices, patch slices) of a (2r+1)-pixel patch centred on `center`,
+    # clipped to the mask, or None when it falls entirely outside
     # Determine where to place the patch in the main mask
     x_center, y_center = center
     x0 = x_center - radius
@@ -73,48 +280,432 @@ def draw_blush_gradient(mask: np.array, center: tuple, radius: int, color: list)
     # Handle boundaries of the main mask
     mask_y0 = max(0, y0)
     mask_x0 = max(0, x0)
-    mask_y1 = min(mask.shape[0], y1)
-    mask_x1 = min(mask.shape[1], x1)
+    mask_y1 = min(shape[0], y1)
+    mask_x1 = min(shape[1], x1)
+    if mask_y0 >= mask_y1 or mask_x0 >= mask_x1:
+        return None
 
     patch_y0 = mask_y0 - y0
     patch_x0 = mask_x0 - x0
     patch_y1 = patch_y0 + (mask_y1 - mask_y0)
     patch_x1 = patch_x0 + (mask_x1 - mask_x0)
+    return (slice(mask_y0, mask_y1), slice(mask_x0, mask_x1)), (slice(patch_y0, patch_y1), slice(patch_x0, patch_x1))
+
+
+def draw_blush_gradient(mask: np.array, center: tuple, radius: int, color: list, alpha: float = 1.0):
+    patch = blush_sprite(radius, tuple(int(c) for c in color))
+    bounds = clip_patch(mask.shape, center, radius)
+    if bounds is None:
+        return
+    mask_slices, patch_slices = bounds
 
     # Blend the gradient patch into the mask
-    patch_region = patch[patch_y0:patch_y1, patch_x0:patch_x1]
-    mask[mask_y0:mask_y1, mask_x0:mask_x1] = cv2.add(
-        mask[mask_y0:mask_y1, mask_x0:mask_x1], patch_region
-    )
+    patch_region = patch[patch_slices]
+    mask_region = mask[mask_slices]
+    cv2.addWeighted(mask_region, 1.0, patch_region, alpha, 0, dst=mask_region)
 
-def add_mask(mask: np.array, idx_to_coordinates: dict, face_connections: list, colors: list):
-    for i, connection in enumerate(face_connections):
+def add_mask(mask: np.array, idx_to_coordinates, face_connections: list, colors: list, valid: np.array = None, blush_radius: int = None, blur_kernel: tuple = MASK_BLUR_KERNEL, blur_sigma: float = MASK_BLUR_SIGMA, kinds: tuple = None):
+    # idx_to_coordinates is either the read_landmarks dict or the (N, 2) array
+    # from read_landmark_array together with its validity mask; kinds: the
+    # region_kind() of each connection, when already known
+    start = time.perf_counter()
+    if blush_radius is None:
+        blush_radius = blush_radius_for(idx_to_coordinates, valid)
+    if kinds is None:
+        kinds = [region_kind(connection) for connection in face_connections]
+    for i, (connection, kind) in enumerate(zip(face_connections, kinds)):
         # If this connection corresponds to FOUNDATION, draw it with lower opacity.
-        if connection == face_points["FACE"]:
-            points = np.array([idx_to_coordinates[idx] for idx in connection if idx in idx_to_coordinates])
+        if kind == "foundation":
+            points = region_points(idx_to_coordinates, connection, valid)
             if points.size > 0:
                 foundation_overlay = np.zeros_like(mask)
                 cv2.fillPoly(foundation_overlay, [points], colors[i])
                 # Use a lower alpha (e.g., 0.4) for foundation
-                mask = cv2.addWeighted(mask, 1.0, foundation_overlay, 0.4, 0)
-        elif len(connection) == 1 and connection[0] in (50, 280):  # Blush points
-            center = idx_to_coordinates.get(connection[0])
+                mask = cv2.addWeighted(mask, 1.0, foundation_overlay, FOUNDATION_ALPHA, 0, dst=mask)
+        elif kind == "blush":
+            center = region_point(idx_to_coordinates, connection[0], valid)
             if center:
-                blush_overlay = np.zeros_like(mask)
-                draw_blush_gradient(blush_overlay, center, radius=30, color=colors[i])
                 # Use an alpha of 0.5 to make blush transparent.
-                mask = cv2.addWeighted(mask, 1.0, blush_overlay, 0.5, 0)
-        elif len(connection) < 3:
-            point = idx_to_coordinates.get(connection[0])
+                draw_blush_gradient(mask, center, radius=blush_radius, color=colors[i], alpha=BLUSH_ALPHA)
+        elif kind == "point":
+            point = region_point(idx_to_coordinates, connection[0], valid)
             if point:
                 cv2.circle(mask, point, radius=15, color=colors[i], thickness=-1)
         else:
-            points = np.array([idx_to_coordinates[idx] for idx in connection if idx in idx_to_coordinates])
+            points = region_points(idx_to_coordinates, connection, valid)
             if points.size > 0:
                 cv2.fillPoly(mask, [points], colors[i])
-    mask = cv2.GaussianBlur(mask, (7, 7), 4)
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="mask")
+    with STAGE_SECONDS.time(stage="blur"):
+        mask = cv2.GaussianBlur(mask, blur_kernel, blur_sigma, dst=mask)
     return mask
 
+
+def face_bbox(landmarks: np.array, valid: np.array, shape: tuple, padding: int):
+    # (x0, y0, x1, y1) around the valid landmarks, padded and clipped to the frame
+    points = landmarks[valid] if valid is not None else landmarks
+    if len(points) == 0:
+        return None
+    height, width = shape[:2]
+    x0, y0 = points.min(axis=0) - padding
+    x1, y1 = points.max(axis=0) + padding + 1
+    x0, y0 = max(0, int(x0)), max(0, int(y0))
+    x1, y1 = min(width, int(x1)), min(height, int(y1))
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+class RoiCompositor:
+    """Composites makeup inside the face bounding box only.
+
+    The mask is built, blurred and blended on the padded face crop, and the
+    result is written into an output buffer that is reused across frames, so a
+    frame costs one full-size copy instead of several full-size temporaries.
+    The returned array is overwritten by the next render() call.
+    """
+
+    def __init__(self):
+        self._mask = None
+        self._output = None
+
+    def _buffers(self, shape: tuple):
+        if self._output is None or self._output.shape != shape:
+            # flat so every crop size gets a contiguous view of the same memory
+            self._mask = np.empty(int(np.prod(shape)), dtype=np.uint8)
+            self._output = np.empty(shape, dtype=np.uint8)
+        return self._mask, self._output
+
+    def render(self, image: np.array, landmarks: np.array, valid: np.array, plan: RenderPlan, output: np.array = None):
+        # output: write the frame here instead of the reused buffer
+        blush_radius = blush_radius_for(landmarks, valid)
+        # blush gradients reach their radius past the centre and the blur
+        # spreads the mask by half a kernel; beyond that the mask is zero
+        bbox = face_bbox(landmarks, valid, image.shape, blush_radius + blur_padding(plan))
+        if bbox is None:
+            return image
+        x0, y0, x1, y1 = bbox
+        mask_buffer, buffer = self._buffers(image.shape)
+        if output is None:
+            output = buffer
+        mask = mask_buffer[:(y1 - y0) * (x1 - x0) * image.shape[2]].reshape(y1 - y0, x1 - x0, image.shape[2])
+        mask[:] = 0
+        offset = np.array((x0, y0), dtype=landmarks.dtype)
+        mask = add_mask(mask, idx_to_coordinates=landmarks - offset, face_connections=plan.connections, colors=plan.colors, valid=valid, blush_radius=blush_radius, blur_kernel=plan.blur_kernel, blur_sigma=plan.blur_sigma, kinds=plan.kinds)
+        with STAGE_SECONDS.time(stage="blend"):
+            np.copyto(output, image)
+            cv2.addWeighted(image[y0:y1, x0:x1], 1.0, mask, plan.intensity, 1, dst=output[y0:y1, x0:x1])
+        return output
+
+@functools.lru_cache(maxsize=128)
+def blush_alpha_sprite(radius: int, color: tuple, alpha: float):
+    # (premultiplied colour, 255 * (1 - weight)) patches for blending the blush
+    # gradient over a frame: frame * inverse / 255 + premultiplied. color is a
+    # BGR triple, or a 1-tuple for a single YUV plane
+    weight = blush_kernel(radius) * alpha
+    if len(color) > 1:
+        weight = weight[:, :, None]
+    premultiplied = np.round(weight * np.array(color, dtype=np.float64)).astype(np.uint8)
+    inverse = np.round(255 * (1 - weight)).astype(np.uint8)
+    if len(color) > 1:
+        inverse = inverse.repeat(len(color), axis=2)
+    premultiplied.flags.writeable = False
+    inverse.flags.writeable = False
+    return premultiplied, inverse
+
+
+def blend_sprite(target: np.array, center: tuple, radius: int, color: tuple, alpha: float):
+    bounds = clip_patch(target.shape, center, radius)
+    if bounds is None:
+        return
+    premultiplied, inverse = blush_alpha_sprite(radius, color, alpha)
+    mask_slices, patch_slices = bounds
+    region = target[mask_slices]
+    cv2.multiply(region, inverse[patch_slices], dst=region, scale=1 / 255)
+    cv2.add(region, premultiplied[patch_slices], dst=region)
+
+
+def bgr_to_yuv(color) -> tuple:
+    # (Y, U, V) of a BGR colour, with the same conversion as COLOR_YUV2RGB_I420
+    patch = np.full((2, 2, 3), color, dtype=np.uint8)
+    yuv = cv2.cvtColor(patch, cv2.COLOR_BGR2YUV_I420)
+    return int(yuv[0, 0]), int(yuv[2, 0]), int(yuv[2, 1])
+
+
+def region_kind(connection) -> str:
+    # how add_mask draws a region: "foundation", "blush", "point" or "polygon"
+    if np.array_equal(connection, face_points["FACE"]):
+        return "foundation"
+    if len(connection) == 1 and connection[0] in (50, 280):
+        return "blush"
+    if len(connection) < 3:
+        return "point"
+    return "polygon"
+
+
+class LabelMapCompositor(RoiCompositor):
+    """Alpha-blends makeup inside the face bounding box in one table lookup.
+
+    Regions are rasterized into a label map (one id per region, later regions
+    on top) and their opacities into one alpha map, which is blurred for soft
+    edges; labels are dilated into the blurred rim so every pixel with alpha
+    has a colour. Each pixel then indexes a table of (region, alpha level) ->
+    premultiplied colour, and the face box is blended as
+    frame * (1 - alpha) + colour * alpha instead of the mask being added on
+    top, so colours never clip. The tables come precompiled in the render
+    plan (build_label_tables()). Blush gradients overlap the foundation and
+    fade out radially, so they are blended over the result as cached sprites
+    instead of labels.
+
+    render() works on BGR frames. render_yuv() blends the same maps into the
+    planes of an I420 frame with the colours converted to YUV: the blend is
+    affine, so it matches blending in RGB, with the chroma planes taking
+    every other label and alpha.
+    """
+
+    def _label_maps(self, label_buffer: np.array, shape: tuple, landmarks: np.array, valid: np.array, plan: RenderPlan, even: bool = False):
+        # (bbox, packed index map, [(blush centre, colour index)]) for a frame
+        # of `shape`, or None without a face box; even: align the box to 2x2
+        # blocks for the chroma planes
+        # blush is blended on the frame itself, so the box only needs the blur
+        bbox = face_bbox(landmarks, valid, shape, blur_padding(plan))
+        if bbox is None:
+            return None
+        x0, y0, x1, y1 = bbox
+        if even:
+            x0, y0 = x0 - x0 % 2, y0 - y0 % 2
+            x1, y1 = min(shape[1], x1 + x1 % 2), min(shape[0], y1 + y1 % 2)
+        tables = plan.label_tables
+
+        start = time.perf_counter()
+        labels = label_buffer[:(y1 - y0) * (x1 - x0)].reshape(y1 - y0, x1 - x0)
+        labels[:] = 0
+        offset = np.array((x0, y0), dtype=landmarks.dtype)
+        local = landmarks - offset
+        blush_centers = []
+        for i, (connection, kind) in enumerate(zip(plan.connections, plan.kinds)):
+            if kind == "blush":
+                center = region_point(landmarks, connection[0], valid)
+                if center:
+                    blush_centers.append((center, i))
+            elif kind == "point":
+                point = region_point(local, connection[0], valid)
+                if point:
+                    cv2.circle(labels, point, radius=15, color=(i + 1) * tables.levels, thickness=-1)
+            else:
+                points = region_points(local, connection, valid)
+                if points.size > 0:
+                    cv2.fillPoly(labels, [points], (i + 1) * tables.levels)
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="mask")
+
+        with STAGE_SECONDS.time(stage="blur"):
+            alpha = cv2.LUT(labels, tables.alpha_lut)
+            cv2.GaussianBlur(alpha, plan.blur_kernel, plan.blur_sigma, dst=alpha)
+            grown = cv2.dilate(labels, tables.dilate_kernel)
+            cv2.copyTo(labels, labels, grown)
+            index = cv2.add(grown, alpha)
+        return (x0, y0, x1, y1), index, blush_centers
+
+    def render(self, image: np.array, landmarks: np.array, valid: np.array, plan: RenderPlan, output: np.array = None):
+        # output: write the frame here instead of the reused buffer
+        label_buffer, buffer = self._buffers(image.shape)
+        maps = self._label_maps(label_buffer, image.shape, landmarks, valid, plan)
+        if maps is None:
+            return image
+        (x0, y0, x1, y1), index, blush_centers = maps
+        tables = plan.label_tables
+        if output is None:
+            output = buffer
+
+        with STAGE_SECONDS.time(stage="blend"):
+            np.copyto(output, image)
+            region = output[y0:y1, x0:x1]
+            inverse = cv2.cvtColor(cv2.LUT(index, tables.inverse_lut), cv2.COLOR_GRAY2BGR)
+            cv2.multiply(image[y0:y1, x0:x1], inverse, dst=region, scale=1 / 255)
+            cv2.add(region, cv2.merge([cv2.LUT(index, lut) for lut in tables.bgr_luts]), dst=region)
+            blush_radius = blush_radius_for(landmarks, valid)
+            for center, i in blush_centers:
+                blend_sprite(output, center, blush_radius, plan.colors[i], tables.blush_alpha)
+        return output
+
+    def render_yuv(self, yuv: np.array, landmarks: np.array, valid: np.array, plan: RenderPlan, output: np.array = None):
+        # yuv: an I420 frame as from VideoFrame.to_ndarray(), (height * 3 / 2,
+        # width) with even sides; landmarks are luma pixels
+        height, width = yuv.shape[0] * 2 // 3, yuv.shape[1]
+        label_buffer, buffer = self._buffers(yuv.shape)
+        maps = self._label_maps(label_buffer, (height, width), landmarks, valid, plan, even=True)
+        if maps is None:
+            return yuv
+        (x0, y0, x1, y1), index, blush_centers = maps
+        tables = plan.label_tables
+        if output is None:
+            output = buffer
+
+        with STAGE_SECONDS.time(stage="blend"):
+            np.copyto(output, yuv)
+            source_planes = i420_planes(yuv)
+            planes = i420_planes(output)
+            # luma at full resolution, chroma from the top-left of each 2x2 block
+            chroma_index = cv2.resize(index, ((x1 - x0) // 2, (y1 - y0) // 2), interpolation=cv2.INTER_NEAREST)
+            for plane, source, lut, (indices, scale) in zip(planes, source_planes, tables.yuv_luts, ((index, 1), (chroma_index, 2), (chroma_index, 2))):
+                box = np.s_[y0 // scale:y1 // scale, x0 // scale:x1 // scale]
+                region = plane[box]
+                cv2.multiply(source[box], cv2.LUT(indices, tables.inverse_lut), dst=region, scale=1 / 255)
+                cv2.add(region, cv2.LUT(indices, lut), dst=region)
+            blush_radius = blush_radius_for(landmarks, valid)
+            for center, i in blush_centers:
+                for plane, value, scale in zip(planes, tables.yuv_colors[i], (1, 2, 2)):
+                    blend_sprite(plane, (center[0] // scale, center[1] // scale), max(1, blush_radius // scale), (value,), tables.blush_alpha)
+        return output
+
+
+def i420_planes(yuv: np.array) -> tuple:
+    # (Y, U, V) views of an I420 frame stacked as (height * 3 / 2, width)
+    height, width = yuv.shape[0] * 2 // 3, yuv.shape[1]
+    chroma = yuv[height:].reshape(2, height // 2, width // 2)
+    return yuv[:height], chroma[0], chroma[1]
+
+
+def create_compositor(roi_compositing: bool = True, blend_mode: str = "alpha"):
+    # "alpha" always works on the face box; "additive" is the add_mask look,
+    # on the face box or (compositor None) on the whole frame
+    if blend_mode == "alpha":
+        return LabelMapCompositor()
+    if blend_mode != "additive":
+        raise ValueError(f"Unknown blend mode {blend_mode!r}, expected one of {BLEND_MODES}")
+    return RoiCompositor() if roi_compositing else None
+
+def hex_to_bgr(hex_color: str):
+    hex_color = hex_color.lstrip("#")
+    return [int(hex_color[i:i+2], 16) for i in (4, 2, 0)]
+
+def blur_padding(plan: RenderPlan) -> int:
+    # blurring spreads the mask by half a kernel; beyond that it is zero
+    return plan.blur_kernel[0] // 2 + 1
+
+def _frozen(array: np.array) -> np.array:
+    array.flags.writeable = False
+    return array
+
+def build_label_tables(kinds: tuple, alphas: tuple, colors: tuple, intensity: float, blur_kernel: tuple = MASK_BLUR_KERNEL) -> LabelTables:
+    # regions are painted as label * levels (labels 1..n, 0 for no makeup)
+    # and their alpha is kept in 0..levels-1 steps, so label + alpha is an
+    # 8-bit index into the colour tables
+    levels = 256 // (len(kinds) + 1)
+    used = (len(kinds) + 1) * levels
+    alpha_lut = np.zeros(256, dtype=np.uint8)
+    region_colors = np.zeros((len(kinds) + 1, 3))
+    for i, (kind, region_alpha) in enumerate(zip(kinds, alphas)):
+        if kind != "blush":
+            alpha_lut[(i + 1) * levels] = round(region_alpha * (levels - 1))
+            region_colors[i + 1] = colors[i]
+    level_alpha = np.arange(levels) / (levels - 1) * intensity
+    inverse_lut = np.full(256, 255, dtype=np.uint8)
+    inverse_lut[:used] = np.tile(np.round(255 * (1 - level_alpha)), len(kinds) + 1)
+    region_yuv = np.array([bgr_to_yuv(color) for color in region_colors.astype(np.uint8)], dtype=np.float64)
+    luts = []
+    for palette in (region_colors, region_yuv):
+        premultiplied = np.zeros((256, 3), dtype=np.uint8)
+        premultiplied[:used] = np.round(palette[:, None, :] * level_alpha[None, :, None]).reshape(-1, 3)
+        luts.append(tuple(_frozen(np.ascontiguousarray(premultiplied[:, c])) for c in range(3)))
+    blush_alpha = intensity * BLUSH_ALPHA
+    yuv_colors = tuple(bgr_to_yuv(color) for color in colors)
+    dilate_kernel = np.ones(blur_kernel, dtype=np.uint8)
+    return LabelTables(levels, _frozen(alpha_lut), _frozen(inverse_lut), luts[0], luts[1], yuv_colors, blush_alpha, _frozen(dilate_kernel))
+
+def compile_render_plan(makeup_params: dict, intensity: float, blur_kernel: tuple = MASK_BLUR_KERNEL, blur_sigma: float = MASK_BLUR_SIGMA) -> RenderPlan:
+    # everything process_frame() needs from a session's settings, parsed and
+    # precomputed once; raises ValueError on a malformed colour or intensity.
+    # Regions missing from makeup_params are left out: the alpha blend would
+    # otherwise paint them black
+    elements = [element for element in FACE_ELEMENTS if makeup_params.get(element)]
+    colors = tuple(tuple(hex_to_bgr(makeup_params[element])) for element in elements)
+    connections = tuple(face_point_indices["FACE"] if element == "FOUNDATION" else face_point_indices[element] for element in elements)
+    kinds = tuple(region_kind(connection) for connection in connections)
+    region_alphas = {"foundation": FOUNDATION_ALPHA, "blush": BLUSH_ALPHA}
+    alphas = tuple(region_alphas.get(kind, REGION_ALPHA) for kind in kinds)
+    intensity = float(intensity)
+    # the alpha blend clamps intensity; the additive blend has always taken it as is
+    label_tables = build_label_tables(kinds, alphas, colors, min(max(intensity, 0.0), 1.0), blur_kernel)
+    return RenderPlan(colors, connections, kinds, alphas, intensity, tuple(blur_kernel), blur_sigma, label_tables)
+
+# Seconds between logs of the same landmark inference error; in between,
+# repeats are only counted (makeup_landmark_failures_total)
+LANDMARK_ERROR_LOG_INTERVAL = 60.0
+# exception type name -> (last logged, repeats since)
+_landmark_errors = {}
+
+def log_landmark_error(e: Exception):
+    name = type(e).__name__
+    now = time.monotonic()
+    logged, repeats = _landmark_errors.get(name, (None, 0))
+    if logged is not None and now - logged < LANDMARK_ERROR_LOG_INTERVAL:
+        _landmark_errors[name] = (logged, repeats + 1)
+        return
+    suffix = f" ({repeats} more since the last report)" if repeats else ""
+    print(f"Error reading landmarks: {name}: {e}{suffix}")
+    _landmark_errors[name] = (now, 0)
+
+def frame_landmarks(img, engine=None):
+    # (landmarks, valid), or None when no face was found or inference raised
+    try:
+        with STAGE_SECONDS.time(stage="landmarks"):
+            landmarks, valid = read_landmark_array(img, engine=engine)
+    except Exception as e:
+        LANDMARK_FAILURES.inc(reason="error")
+        log_landmark_error(e)
+        return None
+    if landmarks is None or not valid.any():
+        LANDMARK_FAILURES.inc(reason="no_face")
+        return None
+    return landmarks, valid
+
+def record_frame(engine, start: float):
+    # report the frame's full latency to engines that schedule on it
+    # (LandmarkScheduler)
+    record = getattr(engine, "record_frame", None)
+    if record is not None:
+        record(time.perf_counter() - start)
+
+def process_frame(img, plan, engine=None, compositor=None):
+    # plan: the session's RenderPlan, from compile_render_plan()
+    start = time.perf_counter()
+    found = frame_landmarks(img, engine)
+    if found is None:
+        return img
+    landmarks, valid = found
+    processed = composite_frame(img, landmarks, valid, plan, compositor)
+    record_frame(engine, start)
+    return processed
+
+def process_yuv_frame(yuv, plan, engine=None, compositor=None):
+    # process_frame for an I420 frame (VideoFrame.to_ndarray() of yuv420p):
+    # FaceMesh gets the one RGB conversion and the makeup is blended into the
+    # planes, so the frame never goes through BGR. compositor must have
+    # render_yuv(), i.e. be a LabelMapCompositor
+    start = time.perf_counter()
+    with STAGE_SECONDS.time(stage="yuv_to_rgb"):
+        rgb = cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB_I420)
+    found = frame_landmarks(rgb, engine)
+    if found is None:
+        return yuv
+    landmarks, valid = found
+    if compositor is None:
+        compositor = LabelMapCompositor()
+    processed = compositor.render_yuv(yuv, landmarks, valid, plan)
+    record_frame(engine, start)
+    return processed
+
+def composite_frame(img, landmarks, valid, plan, compositor=None, output=None):
+    # the drawing half of process_frame, for callers that already have landmarks
+    if compositor is not None:
+        return compositor.render(img, landmarks, valid, plan, output)
+    mask = np.zeros_like(img)
+    mask = add_mask(mask, idx_to_coordinates=landmarks, face_connections=plan.connections, colors=plan.colors, valid=valid, blur_kernel=plan.blur_kernel, blur_sigma=plan.blur_sigma, kinds=plan.kinds)
+    with STAGE_SECONDS.time(stage="blend"):
+        processed = cv2.addWeighted(img, 1.0, mask, plan.intensity, 1, dst=output)
+    return processed
+
 def parse_all_hex_colors(hex_color: str) -> list:
     colors = []
     parts = hex_color.split(',')
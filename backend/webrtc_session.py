@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+from aiortc.contrib.media import VideoFrame
+
+from utils import DEFAULT_MAKEUP, compile_render_plan, create_compositor, process_frame, process_yuv_frame
+from landmark_scheduler import create_landmark_engine
+from frame_mailbox import LatestValueMailbox, MailboxClosed
+from metrics import FRAMES_DROPPED, FRAMES_RENDERED, STAGE_SECONDS
+
+# blend intensity when an offer does not set one
+DEFAULT_INTENSITY = 0.2
+
+class MakeupSettings:
+    """A session's makeup settings and the RenderPlan compiled from them.
+
+    update() merges datachannel changes into a new params dict, compiles the
+    plan and only then swaps both in, so a frame reading `plan` sees either
+    the old settings or the new ones, never a mix, and a bad update leaves
+    the previous plan in place.
+    """
+
+    def __init__(self, makeup_params: dict, intensity: float):
+        self.params = dict(makeup_params)
+        self.intensity = intensity
+        self.plan = compile_render_plan(self.params, self.intensity)
+
+    def update(self, makeup_params: dict = None, intensity: float = None):
+        params = {**self.params, **makeup_params} if makeup_params is not None else self.params
+        intensity = intensity if intensity is not None else self.intensity
+        plan = compile_render_plan(params, intensity)
+        self.params, self.intensity, self.plan = params, intensity, plan
+
+class LatestFrameTrack(MediaStreamTrack):
+    kind = "video"
+    def __init__(self, track, makeup, render_pool=None, roi_compositing=True, landmark_options=None, blend_mode="alpha", frame_format="yuv", landmark_engine=None):
+        super().__init__()
+        self.track = track
+        # MakeupSettings; each frame renders with the plan current when it starts
+        self.makeup = makeup
+        # Holds only the newest decoded frame; older ones are counted as dropped
+        self.mailbox = LatestValueMailbox()
+        self.render_dropped = 0
+        self.render_session = None
+        self.landmark_engine = landmark_engine
+        # only the alpha compositor can blend into YUV planes
+        self.yuv_frames = frame_format == "yuv" and blend_mode == "alpha"
+        if render_pool is not None:
+            # Sticky worker process that keeps this session's FaceMesh
+            self.render_session = render_pool.open_session()
+        else:
+            # Streaming-mode FaceMesh reused for every frame of this session;
+            # callers on the event loop build it off-thread and pass it in
+            if self.landmark_engine is None:
+                self.landmark_engine = create_landmark_engine(**(landmark_options or {}))
+            self.compositor = create_compositor(roi_compositing, blend_mode)
+        self._reader = asyncio.create_task(self._update())
+
+    @property
+    def dropped_frames(self):
+        return self.mailbox.dropped + self.render_dropped
+
+    async def _update(self):
+        try:
+            while True:
+                frame = await self.track.recv()
+                # Overwrite with the most recent frame
+                if self.mailbox.put(frame):
+                    FRAMES_DROPPED.inc(reason="superseded")
+        except MediaStreamError:
+            # The incoming track ended
+            pass
+        finally:
+            self.mailbox.close()
+
+    async def recv(self):
+        while True:
+            # Wait until a frame is available
+            try:
+                frame = await self.mailbox.get()
+            except MailboxClosed:
+                self.stop()
+                raise MediaStreamError
+            # decoders hand over I420; odd sizes have no clean 2x2 chroma blocks
+            yuv = self.yuv_frames and frame.format.name == "yuv420p" and frame.width % 2 == 0 and frame.height % 2 == 0
+            with STAGE_SECONDS.time(stage="to_ndarray"):
+                img = frame.to_ndarray() if yuv else frame.to_ndarray(format="bgr24")
+            plan = self.makeup.plan
+            if self.render_session is None:
+                # Process frame off-thread
+                render = process_yuv_frame if yuv else process_frame
+                processed = await asyncio.to_thread(render, img, plan, self.landmark_engine, self.compositor)
+                break
+            start = time.perf_counter()
+            processed = await self.render_session.render(img, plan, "yuv" if yuv else "bgr")
+            if processed is not None:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="render_pool")
+                break
+            # The pool is saturated: drop this frame and take a fresher one
+            self.render_dropped += 1
+            FRAMES_DROPPED.inc(reason="render_pool")
+        with STAGE_SECONDS.time(stage="from_ndarray"):
+            new_frame = VideoFrame.from_ndarray(processed, format="yuv420p" if yuv else "bgr24")
+        FRAMES_RENDERED.inc()
+        new_frame.pts = frame.pts
+        new_frame.time_base = frame.time_base
+        return new_frame
+
+    def stop(self):
+        super().stop()
+        self._reader.cancel()
+        self.mailbox.close()
+        if self.render_session is not None:
+            self.render_session.close()
+        if self.landmark_engine is not None:
+            self.landmark_engine.close()
+
+async def handle_offer(params: dict, pcs: set, render_pool=None, roi_compositing=True, landmark_options=None, blend_mode="alpha", frame_format="yuv", landmark_engine=None) -> dict:
+    # Answer a browser offer with a peer connection that sends the made-up video back.
+    # landmark_engine, when given, goes to the first video track and is closed
+    # here if the offer has none
+    offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
+    makeup = params.get("makeup", {})
+    try:
+        settings = MakeupSettings(makeup.get("selectedMakeup", DEFAULT_MAKEUP), makeup.get("blendIntensity", DEFAULT_INTENSITY))
+    except Exception as e:
+        print("Error in offer makeup, using the defaults:", e)
+        settings = MakeupSettings(DEFAULT_MAKEUP, DEFAULT_INTENSITY)
+
+    pc = RTCPeerConnection()
+    pcs.add(pc)
+    # replaced as a whole plan on datachannel updates, read once per frame
+    pc._makeup = settings
+    pc._tracks = []
+    spare_engines = [landmark_engine] if landmark_engine is not None else []
+
+    @pc.on("connectionstatechange")
+    async def on_connectionstatechange():
+        if pc.connectionState in ("failed", "closed"):
+            await pc.close()
+            pcs.discard(pc)
+            # RTCPeerConnection.close() does not stop locally added tracks
+            for track in pc._tracks:
+                track.stop()
+
+    @pc.on("datachannel")
+    def on_datachannel(channel):
+        @channel.on("message")
+        def on_message(message):
+            try:
+                data = json.loads(message)
+                if "selectedMakeup" in data or "blendIntensity" in data:
+                    pc._makeup.update(data.get("selectedMakeup"), data.get("blendIntensity"))
+            except Exception as e:
+                print("Error updating parameters:", e)
+
+    @pc.on("track")
+    def on_track(track):
+        if track.kind == "video":
+            engine = spare_engines.pop() if spare_engines else None
+            latest_track = LatestFrameTrack(track, pc._makeup, render_pool, roi_compositing, landmark_options, blend_mode, frame_format, engine)
+            pc._tracks.append(latest_track)
+            pc.addTrack(latest_track)
+
+    try:
+        await pc.setRemoteDescription(offer)
+    finally:
+        for engine in spare_engines:
+            engine.close()
+        spare_engines.clear()
+    answer = await pc.createAnswer()
+    await pc.setLocalDescription(answer)
+    return {
+        "sdp": pc.localDescription.sdp,
+        "type": pc.localDescription.type,
+    }